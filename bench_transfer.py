@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Transfer benchmark for figma_get
+
+Serves a synthetic /components listing from figma_stub_server and
+downloads it through extract_icons.scheduled_get with and without
+Accept-Encoding, reporting bytes on the wire, wall time and the time
+spent decompressing.
+
+Usage:
+  python3 bench_transfer.py                          # 20k icons, loopback speed
+  python3 bench_transfer.py -n 50000 --bandwidth 5   # cap at 5 MB/s
+"""
+
+import argparse
+import statistics
+import tempfile
+from pathlib import Path
+
+import extract_icons
+import figma_stub_server
+
+
+def run(url, accept, rounds, dest):
+    headers = {"X-Figma-Token": "bench"}
+    if accept:
+        headers["Accept-Encoding"] = accept
+    walls, decodes, wire = [], [], 0
+    for _ in range(rounds):
+        resp = extract_icons.scheduled_get(url, headers, dest=dest)
+        assert resp.status == 200, resp.status
+        walls.append(resp.elapsed)
+        decodes.append(resp.decode_time)
+        wire = resp.wire_bytes
+    return wire, statistics.median(walls), statistics.median(decodes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", "--icons", type=int, default=20000)
+    parser.add_argument("-r", "--rounds", type=int, default=5)
+    parser.add_argument("--bandwidth", type=float, default=0,
+                        help="server send cap in MB/s (0 = unlimited)")
+    args = parser.parse_args()
+
+    extract_icons.scheduler.rate = 1000.0
+    extract_icons.scheduler.burst = 1000
+    routes = figma_stub_server.synthetic_library(args.icons)
+    endpoint = "/files/{}/components".format(figma_stub_server.FILE_KEY)
+    config = figma_stub_server.StubConfig(bandwidth=args.bandwidth * 1024 * 1024)
+    server = figma_stub_server.start(routes, config)
+    payload = server.routes["/v1" + endpoint]["identity"]
+    url = "http://127.0.0.1:{}/v1{}".format(server.server_port, endpoint)
+
+    print("Payload: {:,} icons, {:,} bytes decoded".format(args.icons, len(payload)))
+    print("{:<10} {:>14} {:>10} {:>10} {:>10}".format(
+        "encoding", "bytes on wire", "ratio", "wall", "decode"))
+    with tempfile.TemporaryDirectory() as tmp:
+        dest = Path(tmp) / "body.json"
+        for accept in ("", "gzip", "deflate"):
+            wire, wall, decode = run(url, accept, args.rounds, dest)
+            assert dest.read_bytes() == payload
+            print("{:<10} {:>14,} {:>9.1f}% {:>9.3f}s {:>9.3f}s".format(
+                accept or "identity", wire, 100.0 * wire / len(payload), wall, decode))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
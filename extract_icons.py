@@ -5,27 +5,83 @@ Figma Icon Extractor
 Extracts component keys from a published Figma library and combines them
 with local SVG files to produce:
 
-  icons.json            – full icon metadata (keys, variants, tags)
-  thumbnails.json       – light-theme SVG strings keyed by icon id
-  thumbnails-dark.json  – dark-theme SVG strings keyed by icon id
+  icons.json                   – full icon metadata (keys, variants, tags)
+  thumbnails-packed.json       – light-theme SVGs, each stored once, by icon id
+  thumbnails-dark-packed.json  – dark-theme SVGs, partly as recolourings of light
+  thumbnails.json, thumbnails-dark.json
+                               – the same as flat {icon id: svg} maps, for plugin
+                                 builds that predate the packed files
+                                 (--no-legacy-thumbnails drops them)
 
 Usage:
   export FIGMA_TOKEN="figd_XXXXX"
   python3 extract_icons.py
 
+  python3 extract_icons.py --max-age 3600   # trust cached responses for an hour
+  python3 extract_icons.py --offline        # no network, cache only
+  python3 extract_icons.py --record tapes/2024-06   # save responses to a cassette
+  python3 extract_icons.py --replay tapes/2024-06   # re-run from it, no token needed
+  python3 extract_icons.py --full           # ignore the last run's snapshot
+  python3 extract_icons.py --file-key KEY1 --file-key KEY2=/path/to/svgs --merge
+  python3 extract_icons.py --team 123456789 # a team's published components
+  python3 extract_icons.py --svg-source figma   # no local SVG checkout needed
+  python3 extract_icons.py --watch          # then rebuild as SVGs are edited
+
+After a full run the Figma file version and a fingerprint of every
+record are kept in .figma-cache/; later runs return immediately if the
+version is unchanged and otherwise rebuild only added/changed/removed
+components.
+
+Icons with no matching light SVG get Figma's own component thumbnail
+(a PNG wrapped in an <svg>), fetched concurrently and cached by
+component key; --no-fallback-thumbnails turns this off.
+
+Figma responses are cached in .figma-cache/ and revalidated with
+ETag / Last-Modified, so an unchanged library costs a 304.
+Set FIGMA_API_URL to point at another server (e.g. figma_stub_server.py).
+
 Prerequisites:
   • The Figma file must be published as a library.
-  • Local SVG folders must exist (LIGHT_DIR / DARK_DIR below).
+  • Local SVG folders must exist (LIGHT_DIR / DARK_DIR below), unless
+    --svg-source figma exports them through the Figma image API.  Either
+    folder may instead be a zip/tar(.gz) archive (LIGHT_DIR.zip, ...), or
+    SVG_INPUT may be one archive holding both; nothing is extracted.
 """
 
+import argparse
+import base64
+import codecs
+import ctypes
+import ctypes.util
+import hashlib
+import http.client
 import json
 import os
+import queue
+import random
 import re
+import select
+import shutil
 import ssl
+import struct
 import sys
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
 from pathlib import Path
-from urllib.request import Request, urlopen
-from urllib.error import HTTPError
+from urllib.parse import quote, urlsplit
+
+try:
+    import cairosvg  # optional: only --png-shards needs it (and the cairo library)
+except (ImportError, OSError):
+    cairosvg = None
 
 # macOS Python often lacks root certificates
 _ssl_ctx = ssl.create_default_context()
@@ -43,6 +99,51 @@ LIGHT_DIR = "XAML Active Light Theme"
 DARK_DIR = "XAML Active Dark Theme"
 
 OUTPUT_DIR = Path(".")
+SVG_WORKERS = 16        # threads listing/reading local SVGs (helps most on network mounts)
+
+SVG_SOURCE = "local"    # "figma": export SVGs via /v1/images instead of reading SVG_INPUT
+EXPORT_BATCH = 100      # node ids per /v1/images request
+DOWNLOAD_WORKERS = 8    # concurrent downloads of exported images
+THUMBNAIL_FALLBACK = True  # use Figma's component thumbnail when no light SVG matched
+
+MINIFY_SVGS = True      # minify thumbnails (see minify_svg) before they are written
+SVG_PRECISION = 2       # decimals kept in SVG coordinates when minifying
+TRANSFORM_PRECISION = 6  # decimals kept in scale/rotate/skew and matrix a-d factors
+SVG_SPRITES = False     # also write symbols/ and symbols-dark/ per-context <symbol> sprites
+
+PNG_SHARDS = False      # also write thumbs/ and thumbs-dark/ PNG shards (needs cairosvg)
+PNG_SIZE = 32           # rendered thumbnail edge, in pixels
+RENDER_WORKERS = os.cpu_count() or 1  # processes rasterising SVGs
+OPTIMIZE_PNGS = True    # losslessly recompress shard PNGs (see optimize_png)
+LEGACY_THUMBNAILS = True  # also write flat thumbnails.json / thumbnails-dark.json (see LEGACY_FILES)
+PNG_ATLASES = False     # also write sprites/ and sprites-dark/ per-context PNG atlases
+
+WATCH_DEBOUNCE = 0.5    # --watch: seconds of quiet before a burst of edits is rebuilt
+WATCH_POLL = 1.0        # --watch: rescan interval where inotify is unavailable
+
+FIGMA_API = os.environ.get("FIGMA_API_URL", "https://api.figma.com/v1")  # or a figma_stub_server.py
+HTTP_TIMEOUT = 120      # seconds per socket operation
+POOL_SIZE = 4           # idle keep-alive connections kept per host
+
+# Conditional-request cache for Figma API responses (see --max-age/--offline)
+CACHE_DIR = Path(".figma-cache")
+CACHE_MAX_AGE = None    # seconds a cached response is trusted without asking Figma
+OFFLINE = False         # serve every request from CACHE_DIR, never touch the network
+
+# Request budget shared by every Figma call in a run (all file keys)
+RATE_LIMIT = 2.0        # sustained requests per second
+RATE_BURST = 6          # requests that may go out back-to-back
+MAX_RETRIES = 5         # per request, for 429 / 5xx / connection errors
+BACKOFF_BASE = 1.0      # seconds; doubled per attempt, full jitter
+BACKOFF_MAX = 60.0
+
+STREAM_CHUNK = 64 * 1024  # bytes read per step when streaming response bodies
+ACCEPT_ENCODING = "gzip, deflate"  # set to "" to request uncompressed bodies
+
+CASSETTE_VERSION = 1    # bump when the cassette layout changes (see --record/--replay)
+
+TEAM_PAGE_SIZE = 1000   # items per page when crawling /teams/{id}/components
+PAGE_PREFETCH = 2       # pages fetched ahead of the consumer during a crawl
 
 # ─────────────────────────────────────────────
 # REGEX HELPERS
@@ -88,45 +189,826 @@ def build_tags(icon_name, context):
     return sorted(tags)
 
 
+# ─────────────────────────────────────────────
+# HTTP CONNECTION POOL
+# ─────────────────────────────────────────────
+
+class ConnectionPool:
+    """
+    Thread-safe pool of persistent HTTP(S) connections to one host.
+
+    Connections are handed out one per in-flight request and returned
+    after the response body has been fully read, so consecutive requests
+    reuse the same socket and TLS session instead of handshaking again.
+    """
+
+    def __init__(self, scheme, host, port=None, size=POOL_SIZE, timeout=HTTP_TIMEOUT):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(
+                self.host, self.port, timeout=self.timeout, context=_ssl_ctx
+            )
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _send(self, conn, path, headers):
+        conn.request("GET", path, headers=headers)
+        return conn.getresponse()
+
+    @contextmanager
+    def get(self, path, headers):
+        """Issue a GET and yield the live response; the socket is recycled on exit."""
+        try:
+            conn, reused = self._idle.get_nowait(), True
+        except queue.Empty:
+            conn, reused = self._connect(), False
+
+        try:
+            resp = self._send(conn, path, headers)
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            if not reused:
+                raise
+            # The server dropped an idle keep-alive socket – retry once fresh.
+            conn = self._connect()
+            try:
+                resp = self._send(conn, path, headers)
+            except Exception:
+                conn.close()
+                raise
+
+        try:
+            yield resp
+        except BaseException:
+            conn.close()
+            raise
+        if resp.isclosed() and not resp.will_close:
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+        else:
+            conn.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def pool_for(url):
+    """Return (pool, path) for an absolute URL, creating the host's pool on demand."""
+    parts = urlsplit(url)
+    key = (parts.scheme, parts.hostname, parts.port)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(*key)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    return pool, path
+
+
+# ─────────────────────────────────────────────
+# RESPONSE CACHE
+# ─────────────────────────────────────────────
+
+def endpoint_slug(endpoint):
+    """Filesystem-safe, collision-free name for an endpoint (which embeds the file key)."""
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", endpoint).strip("_")[:80]
+    digest = hashlib.sha1(endpoint.encode("utf-8")).hexdigest()[:10]
+    return "{}-{}".format(slug, digest)
+
+
+def cache_paths(endpoint):
+    """Return (body_path, meta_path) for an endpoint."""
+    base = CACHE_DIR / endpoint_slug(endpoint)
+    return base.with_suffix(".json"), base.with_suffix(".meta.json")
+
+
+def cache_load(endpoint):
+    """Return the cached meta dict for endpoint, or None if nothing usable is stored."""
+    body_path, meta_path = cache_paths(endpoint)
+    if not (body_path.exists() and meta_path.exists()):
+        return None
+    try:
+        return json.loads(meta_path.read_text(encoding="utf-8"))
+    except ValueError:
+        return None
+
+
+@contextmanager
+def atomic_writer(path):
+    """Yield a binary file that replaces `path` only once it is completely written."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), prefix=path.name + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            yield fp
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def write_atomic(path, data):
+    with atomic_writer(path) as fp:
+        fp.write(data)
+
+
+def cache_store_meta(endpoint, headers):
+    """Record validators for a body that has just been written to the cache."""
+    meta = {
+        "endpoint": endpoint,
+        "etag": headers.get("ETag"),
+        "last_modified": headers.get("Last-Modified"),
+        "fetched_at": time.time(),
+    }
+    write_atomic(cache_paths(endpoint)[1], json.dumps(meta, indent=2).encode("utf-8"))
+
+
+def cache_touch(endpoint, meta):
+    """Record that Figma confirmed the cached body is still current."""
+    meta["fetched_at"] = time.time()
+    write_atomic(cache_paths(endpoint)[1], json.dumps(meta, indent=2).encode("utf-8"))
+
+
+# ─────────────────────────────────────────────
+# CASSETTES (record / replay)
+# ─────────────────────────────────────────────
+
+class Cassette:
+    """
+    A directory of recorded Figma responses.
+
+      <dir>/cassette.json        manifest: format version, endpoints, hashes
+      <dir>/<endpoint-slug>.json decoded response bodies
+
+    Recording copies every body figma_fetch resolves (from the network or
+    the cache).  Replaying serves only what was recorded – no token, no
+    network, no scheduler – so a run is byte-for-byte repeatable.
+    """
+
+    MANIFEST = "cassette.json"
+
+    def __init__(self, root, replaying):
+        self.root = Path(root)
+        self.replaying = replaying
+        self._lock = threading.Lock()
+        self.entries = {}
+        if replaying:
+            manifest = self.root / self.MANIFEST
+            if not manifest.exists():
+                raise FigmaAPIError("no cassette at {}".format(self.root))
+            data = json.loads(manifest.read_text(encoding="utf-8"))
+            if data.get("format") != CASSETTE_VERSION:
+                raise FigmaAPIError("cassette {} has format {}, expected {}".format(
+                    self.root, data.get("format"), CASSETTE_VERSION))
+            self.entries = data.get("entries", {})
+        else:
+            self.root.mkdir(parents=True, exist_ok=True)
+
+    def replay(self, endpoint):
+        entry = self.entries.get(endpoint)
+        if entry is None:
+            raise FigmaAPIError("{} was not recorded in cassette {}".format(endpoint, self.root))
+        log_get(endpoint, "replayed from {}".format(self.root))
+        return self.root / entry["file"]
+
+    def record(self, endpoint, body_path):
+        name = endpoint_slug(endpoint) + ".json"
+        with atomic_writer(self.root / name) as out, open(body_path, "rb") as src:
+            shutil.copyfileobj(src, out)
+        digest = hashlib.sha256()
+        with open(self.root / name, "rb") as fp:
+            for chunk in iter(lambda: fp.read(STREAM_CHUNK), b""):
+                digest.update(chunk)
+        with self._lock:
+            self.entries[endpoint] = {
+                "file": name,
+                "bytes": (self.root / name).stat().st_size,
+                "sha256": digest.hexdigest(),
+            }
+            self._save()
+
+    def _save(self):
+        manifest = {
+            "format": CASSETTE_VERSION,
+            "api": FIGMA_API,
+            "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "entries": dict(sorted(self.entries.items())),
+        }
+        write_atomic(self.root / self.MANIFEST,
+                     json.dumps(manifest, indent=2).encode("utf-8"))
+
+
+cassette = None   # set by main() for --record / --replay
+
+
+# ─────────────────────────────────────────────
+# REQUEST SCHEDULER
+# ─────────────────────────────────────────────
+
+class FigmaAPIError(Exception):
+    """A Figma request failed for good (bad token, 4xx, or retries exhausted)."""
+
+
+class RequestScheduler:
+    """
+    Token bucket plus retry policy shared by every Figma request in a run.
+
+    acquire() blocks until the bucket has a token.  A 429 with Retry-After
+    pauses the whole bucket, so concurrent fetches for other file keys back
+    off together instead of each burning its own retries.
+    """
+
+    def __init__(self, rate=RATE_LIMIT, burst=RATE_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._stamp = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self.counters = {"requests": 0, "throttled": 0, "retried": 0, "failed": 0}
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+                self._stamp = now
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    self.counters["requests"] += 1
+                    return
+                else:
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def throttle(self, delay):
+        """Figma answered 429: stop issuing requests for `delay` seconds."""
+        with self._lock:
+            self.counters["throttled"] += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self._tokens = 0.0
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+    def summary(self):
+        c = self.counters
+        return "{} requests, {} throttled, {} retried, {} failed".format(
+            c["requests"], c["throttled"], c["retried"], c["failed"])
+
+
+scheduler = RequestScheduler()
+
+
+def retry_after_seconds(headers):
+    """
+    Parse Retry-After (delta-seconds or HTTP-date); None if absent or
+    invalid.  Capped at BACKOFF_MAX, so a bogus header cannot stall a run.
+    """
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        delay = max(0.0, float(value))
+    except ValueError:
+        try:
+            delay = max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+    if delay > BACKOFF_MAX:
+        sys.stdout.write("  Retry-After {!r} capped at {:.0f}s\n".format(value, BACKOFF_MAX))
+        return BACKOFF_MAX
+    return delay
+
+
+Response = namedtuple(
+    "Response", "status reason headers body elapsed wire_bytes decode_time encoding")
+
+
+class BodyDecoder:
+    """Incremental Content-Encoding decoder (gzip, deflate or identity)."""
+
+    def __init__(self, encoding):
+        self.encoding = (encoding or "identity").strip().lower()
+        if self.encoding not in ("identity", "gzip", "x-gzip", "deflate"):
+            raise http.client.HTTPException(
+                "unsupported Content-Encoding: {}".format(self.encoding))
+        self._z = None
+        self.wire_bytes = 0
+        self.seconds = 0.0
+
+    def _make(self, first):
+        if self.encoding == "deflate":
+            # RFC says zlib-wrapped, but some servers send raw deflate.
+            wbits = zlib.MAX_WBITS if first[:1] == b"\x78" else -zlib.MAX_WBITS
+        else:
+            wbits = 16 + zlib.MAX_WBITS
+        return zlib.decompressobj(wbits)
+
+    def feed(self, chunk):
+        self.wire_bytes += len(chunk)
+        if self.encoding == "identity":
+            return chunk
+        started = time.perf_counter()
+        if self._z is None:
+            self._z = self._make(chunk)
+        try:
+            data = self._z.decompress(chunk)
+        except zlib.error as e:
+            raise http.client.HTTPException("corrupt {} body: {}".format(self.encoding, e))
+        self.seconds += time.perf_counter() - started
+        return data
+
+    def finish(self):
+        if self._z is None:
+            return b""
+        data = self._z.flush()
+        if not self._z.eof:
+            raise http.client.HTTPException("truncated {} body".format(self.encoding))
+        return data
+
+
+def read_body(resp, sink=None):
+    """
+    Read and decode a response body.  With a sink (a binary file) the
+    decoded bytes are written through chunk by chunk; otherwise returned.
+    """
+    decoder = BodyDecoder(resp.headers.get("Content-Encoding"))
+    parts = []
+    write = sink.write if sink is not None else parts.append
+    while True:
+        chunk = resp.read(STREAM_CHUNK)
+        if not chunk:
+            break
+        write(decoder.feed(chunk))
+    # read(amt) returns b"" when the server hangs up early; `length` still
+    # counts what Content-Length promised (identity bodies have no other check).
+    if resp.length:
+        raise http.client.IncompleteRead(b"", resp.length)
+    write(decoder.finish())
+    return (None if sink is not None else b"".join(parts)), decoder
+
+
+def scheduled_get(url, headers, dest=None, throttled=True, retries=None):
+    """
+    GET url through the shared scheduler, retrying 429 / 5xx / connection
+    errors.  Returns a Response; raises OSError when the host stays
+    unreachable.  throttled=False skips the Figma request budget (for
+    downloads from Figma's image CDN) but keeps the retry policy.
+
+    With `dest`, a 200 body is decoded and streamed to that path in chunks
+    (replacing it atomically) and `body` is None, so large responses never
+    sit in memory whole.
+    """
+    pool, path = pool_for(url)
+    retries = MAX_RETRIES if retries is None else retries
+    for attempt in range(retries + 1):
+        last = attempt == retries
+        if throttled:
+            scheduler.acquire()
+        started = time.monotonic()
+        try:
+            with pool.get(path, headers) as resp:
+                if dest is not None and resp.status == 200:
+                    with atomic_writer(dest) as fp:
+                        body, decoder = read_body(resp, fp)
+                else:
+                    body, decoder = read_body(resp)
+        except (http.client.HTTPException, OSError) as e:
+            if last:
+                scheduler.count("failed")
+                raise OSError(str(e)) from e
+            scheduler.count("retried")
+            time.sleep(scheduler.backoff(attempt))
+            continue
+        elapsed = time.monotonic() - started
+
+        if (resp.status == 429 or resp.status >= 500) and not last:
+            delay = retry_after_seconds(resp.headers)
+            if delay is None:
+                delay = scheduler.backoff(attempt)
+            scheduler.count("retried")
+            if resp.status == 429 and throttled:
+                scheduler.throttle(delay)
+            else:
+                time.sleep(delay)
+            continue
+        if resp.status >= 400:
+            scheduler.count("failed")
+        return Response(resp.status, resp.reason, resp.headers, body, elapsed,
+                        decoder.wire_bytes, decoder.seconds, decoder.encoding)
+
+
 # ─────────────────────────────────────────────
 # FIGMA API
 # ─────────────────────────────────────────────
 
-def figma_get(endpoint):
+def log_get(endpoint, detail):
+    """Log a request in a single write; several fetches may run at once."""
+    sys.stdout.write("  GET {}  {}\n".format(endpoint, detail))
+
+
+def figma_fetch(endpoint):
+    """
+    Return the path of an up-to-date response body for endpoint on disk,
+    going through the active cassette (if any) and the response cache.
+    """
+    if cassette is not None and cassette.replaying:
+        return cassette.replay(endpoint)
+    body_path = fetch_cached(endpoint)
+    if cassette is not None:
+        cassette.record(endpoint, body_path)
+    return body_path
+
+
+def fetch_cached(endpoint):
+    """
+    Make sure the response for endpoint is current in the cache and return
+    the path of its body (revalidating, or fetching it afresh).
+    """
+    cached = cache_load(endpoint)
+    body_path = cache_paths(endpoint)[0]
+
+    if OFFLINE:
+        if cached is None:
+            raise FigmaAPIError("offline mode and no cached response for {}".format(endpoint))
+        log_get(endpoint, "offline (cached {})".format(_age(cached)))
+        return body_path
+
+    if cached is not None and CACHE_MAX_AGE is not None:
+        if time.time() - cached.get("fetched_at", 0) <= CACHE_MAX_AGE:
+            log_get(endpoint, "fresh in cache ({})".format(_age(cached)))
+            return body_path
+
     token = os.environ.get("FIGMA_TOKEN", "")
     if not token:
-        print("Error: FIGMA_TOKEN not set.")
-        print("  export FIGMA_TOKEN='figd_...'")
-        sys.exit(1)
-    url = "https://api.figma.com/v1" + endpoint
-    req = Request(url, headers={"X-Figma-Token": token})
+        raise FigmaAPIError("FIGMA_TOKEN not set.\n  export FIGMA_TOKEN='figd_...'")
+
+    headers = {"X-Figma-Token": token}
+    if ACCEPT_ENCODING:
+        headers["Accept-Encoding"] = ACCEPT_ENCODING
+    if cached is not None:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
     try:
-        with urlopen(req, context=_ssl_ctx) as resp:
-            return json.loads(resp.read())
-    except HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        print("Figma API error: {} {} – {}".format(e.code, e.reason, body[:200]))
-        sys.exit(1)
+        resp = scheduled_get(FIGMA_API + endpoint, headers, dest=body_path)
+    except OSError as e:
+        if cached is None:
+            raise FigmaAPIError("cannot reach Figma API ({}) and nothing cached for {}".format(
+                e, endpoint))
+        log_get(endpoint, "unreachable ({}) – using cache ({})".format(e, _age(cached)))
+        return body_path
+
+    if resp.status == 304 and cached is not None:
+        cache_touch(endpoint, cached)
+        log_get(endpoint, "304 not modified  {:.2f}s".format(resp.elapsed))
+        return body_path
+
+    if resp.status != 200:
+        raise FigmaAPIError("Figma API error: {} {} – {}".format(
+            resp.status, resp.reason, (resp.body or b"").decode(errors="replace")[:200]))
+    size = body_path.stat().st_size
+    wire = ""
+    if resp.encoding != "identity":
+        wire = " ({:,} on wire, {}, {:.2f}s decoding)".format(
+            resp.wire_bytes, resp.encoding, resp.decode_time)
+    log_get(endpoint, "{}  {:.2f}s  {:,} bytes{}".format(resp.status, resp.elapsed, size, wire))
+    cache_store_meta(endpoint, resp.headers)
+    return body_path
+
+
+def figma_get(endpoint):
+    """Fetch endpoint and return the decoded JSON document."""
+    with open(figma_fetch(endpoint), "rb") as fp:
+        return json.load(fp)
+
+
+def iter_json_file(body_path, path):
+    """Yield the items of the array at `path` (e.g. "meta", "components") in a cached body."""
+    with open(body_path, "rb") as fp:
+        yield from iter_json_array(fp, path)
+
+
+def _age(meta):
+    secs = int(time.time() - meta.get("fetched_at", 0))
+    if secs < 120:
+        return "{}s old".format(secs)
+    if secs < 7200:
+        return "{}m old".format(secs // 60)
+    return "{}h old".format(secs // 3600)
+
+
+# Only these fields of a component (or set) are used downstream; dropping
+# the rest (user, description, …) keeps long listings small in memory.
+COMPONENT_FIELDS = ("key", "node_id", "name", "updated_at", "thumbnail_url")
+
+
+def slim_component(comp):
+    slim = {k: comp[k] for k in COMPONENT_FIELDS if k in comp}
+    frame = comp.get("containing_frame") or {}
+    slim["containing_frame"] = {
+        k: frame[k] for k in ("nodeId", "pageName") if k in frame
+    }
+    cs = frame.get("containingComponentSet") or {}
+    if cs.get("nodeId"):
+        slim["containing_frame"]["containingComponentSet"] = {"nodeId": cs["nodeId"]}
+    return slim
+
+
+def fetch_figma_data(file_key=None):
+    """
+    Return (components_iter, {set_node_id: set_info}).
+
+    Both listings are downloaded concurrently to the response cache; the
+    components are then yielded lazily as they are parsed off disk.
+    """
+    file_key = file_key or FIGMA_FILE_KEY
+    print("Fetching components and component sets from Figma...")
+    comp_endpoint = "/files/{}/components".format(file_key)
+    sets_endpoint = "/files/{}/component_sets".format(file_key)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        comp_future = executor.submit(figma_fetch, comp_endpoint)
+        sets_future = executor.submit(figma_fetch, sets_endpoint)
+        comp_path = comp_future.result()
+        sets_path = sets_future.result()
+
+    sets_dict = {}
+    for s in iter_json_file(sets_path, ("meta", "component_sets")):
+        sets_dict[s["node_id"]] = slim_component(s)
+
+    components = (slim_component(c) for c in iter_json_file(comp_path, ("meta", "components")))
+    print("  {} component sets; components streamed from cache".format(len(sets_dict)))
+    return components, sets_dict
 
 
-def fetch_figma_data():
-    """Return (components_list, {set_node_id: set_info})."""
-    print("Fetching components from Figma...")
-    comp_data = figma_get("/files/{}/components".format(FIGMA_FILE_KEY))
-    components = comp_data.get("meta", {}).get("components", [])
+# ─────────────────────────────────────────────
+# TEAM LIBRARIES (cursor pagination)
+# ─────────────────────────────────────────────
 
-    print("Fetching component sets from Figma...")
-    sets_data = figma_get("/files/{}/component_sets".format(FIGMA_FILE_KEY))
-    sets_list = sets_data.get("meta", {}).get("component_sets", [])
+class PageCrawler:
+    """
+    Iterate the items of a cursor-paginated team listing
+    (/teams/{id}/components or /component_sets).
+
+    A background thread follows the cursor chain as soon as the crawler is
+    created and keeps up to PAGE_PREFETCH pages queued, so page N+1 is on
+    the wire while page N is being consumed.  After every page the cursor
+    is checkpointed; a crawl that was interrupted resumes from there, with
+    the pages it already had re-read from the response cache.
+    """
+
+    _END = object()
+
+    def __init__(self, team_id, kind, page_size=None):
+        self.team_id = team_id
+        self.kind = kind
+        self.page_size = page_size or TEAM_PAGE_SIZE
+        self.checkpoint = CACHE_DIR / "crawl-{}-{}.json".format(team_id, kind)
+        self.pages = 0
+        self._queue = queue.Queue(maxsize=PAGE_PREFETCH)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+
+    def endpoint(self, after):
+        endpoint = "/teams/{}/{}?page_size={}".format(self.team_id, self.kind, self.page_size)
+        if after is not None:
+            endpoint += "&after={}".format(after)
+        return endpoint
+
+    def _load_checkpoint(self):
+        if self.checkpoint.exists():
+            try:
+                return json.loads(self.checkpoint.read_text(encoding="utf-8"))
+            except ValueError:
+                pass
+        return {"done": [], "after": None}
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        try:
+            state = self._load_checkpoint()
+            if state["done"]:
+                print("  Resuming {} crawl of team {} after {} pages".format(
+                    self.kind, self.team_id, len(state["done"])))
+            for endpoint in state["done"]:
+                if cache_load(endpoint) is not None:
+                    with open(cache_paths(endpoint)[0], "rb") as fp:
+                        data = json.load(fp)
+                else:
+                    data = figma_get(endpoint)
+                if not self._put(data.get("meta", {}).get(self.kind) or []):
+                    return
+
+            after = state["after"]
+            while state["after"] is not None or not state["done"]:
+                endpoint = self.endpoint(after)
+                data = figma_get(endpoint)
+                meta = data.get("meta", {})
+                items = meta.get(self.kind) or []
+                after = (meta.get("cursor") or {}).get("after")
+                if len(items) < self.page_size:
+                    after = None
+                state["done"].append(endpoint)
+                state["after"] = after
+                write_atomic(self.checkpoint, json.dumps(state, indent=1).encode("utf-8"))
+                if not self._put(items) or after is None:
+                    break
+            self._put(self._END)
+        except BaseException as e:
+            self._put(e)
+
+    def __iter__(self):
+        try:
+            while True:
+                page = self._queue.get()
+                if page is self._END:
+                    break
+                if isinstance(page, BaseException):
+                    raise page
+                self.pages += 1
+                yield from page
+            # Crawl finished: the next run starts from the first page again.
+            if self.checkpoint.exists():
+                self.checkpoint.unlink()
+        finally:
+            self._stop.set()
+
+
+def qualify_node_ids(comp):
+    """
+    Team listings span many files whose node ids overlap ("1:23" exists
+    in every file), so prefix them with the file key to keep grouping sound.
+    """
+    file_key = comp.get("file_key", "")
+    comp["node_id"] = "{}/{}".format(file_key, comp["node_id"])
+    frame = comp.get("containing_frame") or {}
+    if frame.get("nodeId"):
+        frame["nodeId"] = "{}/{}".format(file_key, frame["nodeId"])
+    cs = frame.get("containingComponentSet") or {}
+    if cs.get("nodeId"):
+        cs["nodeId"] = "{}/{}".format(file_key, cs["nodeId"])
+    return comp
+
+
+def fetch_team_data(team_id):
+    """
+    Return (components_iter, {set_node_id: set_info}) for a team library,
+    the same shape as fetch_figma_data.  Both crawls start at once; the
+    set crawl is drained first (grouping needs it) while component pages
+    prefetch, then components stream page by page into the consumer.
+    """
+    print("Crawling team {} components and component sets...".format(team_id))
+    comp_crawler = PageCrawler(team_id, "components")
+    sets_crawler = PageCrawler(team_id, "component_sets")
 
     sets_dict = {}
-    for s in sets_list:
+    for s in sets_crawler:
+        s = slim_component(qualify_node_ids(s))
         sets_dict[s["node_id"]] = s
+    print("  {} component sets over {} pages; components streaming".format(
+        len(sets_dict), sets_crawler.pages))
 
-    print("  {} components, {} component sets".format(len(components), len(sets_dict)))
+    components = (slim_component(qualify_node_ids(c)) for c in comp_crawler)
     return components, sets_dict
 
 
+# ─────────────────────────────────────────────
+# STREAMING JSON
+# ─────────────────────────────────────────────
+
+_WS_RE = re.compile(r"[ \t\n\r]*")
+_NUMBER_TAIL_RE = re.compile(r"[-+.eE0-9]*\Z")
+_json_decoder = json.JSONDecoder()
+
+
+class JsonStream:
+    """
+    Minimal pull parser over a binary file.  Structural characters are
+    consumed one by one; every complete value is handed to the C decoder
+    via raw_decode, so only the value being decoded is held in memory.
+    """
+
+    def __init__(self, fp, chunk_size=None):
+        self._fp = fp
+        self._chunk = chunk_size or STREAM_CHUNK
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        data = self._fp.read(self._chunk)
+        if data:
+            text = self._decoder.decode(data)
+        else:
+            text = self._decoder.decode(b"", final=True)
+            self.eof = True
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it."""
+        while True:
+            self.pos = _WS_RE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof:
+                raise ValueError("unexpected end of JSON document")
+            self._fill()
+
+    def take(self, expected=None):
+        ch = self.peek()
+        if expected is not None and ch not in expected:
+            raise ValueError("expected {!r} at offset {}, got {!r}".format(
+                expected, self.pos, ch))
+        self.pos += 1
+        return ch
+
+    def value(self):
+        """Decode and return the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                val, end = _json_decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self._fill()
+                continue
+            # A number reaching the buffer edge may be cut short, even when
+            # raw_decode stopped before it ("12." + "5" parses as 12 first).
+            if not self.eof and _NUMBER_TAIL_RE.match(self.buf, end):
+                self._fill()
+                continue
+            self.pos = end
+            return val
+
+
+def iter_json_array(fp, path, chunk_size=None):
+    """
+    Yield the elements of the array found by following object keys `path`
+    in the JSON document read from fp.  Yields nothing if the path is
+    missing, mirroring data.get(...).get(..., []).
+    """
+    stream = JsonStream(fp, chunk_size)
+
+    def walk(depth):
+        if depth == len(path):
+            if stream.take("[n") == "n":  # null instead of a list
+                return
+            if stream.peek() == "]":
+                stream.take()
+                return
+            while True:
+                yield stream.value()
+                if stream.take(",]") == "]":
+                    return
+        if stream.peek() != "{":
+            stream.value()
+            return
+        stream.take()
+        if stream.peek() == "}":
+            return
+        while True:
+            key = stream.value()
+            stream.take(":")
+            if key == path[depth]:
+                yield from walk(depth + 1)
+                return
+            stream.value()
+            if stream.take(",}") == "}":
+                return
+
+    yield from walk(0)
+
+
 # ─────────────────────────────────────────────
 # VARIANT PROPERTY PARSER
 # ─────────────────────────────────────────────
@@ -162,46 +1044,675 @@ def classify_mode(props):
 # INDEX LOCAL SVGs
 # ─────────────────────────────────────────────
 
-def index_svgs():
+_theme_indexes = {}
+_theme_locks = {}
+_theme_guard = threading.Lock()
+# index_theme key (resolved folder, or "archive!theme") ->
+#   {"files": {relative path: {"mtime", "size", "sha256"}}, "dirty": unsaved changes}
+_svg_manifests = {}
+
+
+def index_theme(theme_path, names=None, theme=None):
+    """
+    Return ({stem: handle}, files_changed, files_seen) for one theme folder,
+    or with `theme` (its folder name), for that theme inside an archive.
+
+    Full walks are memoised per resolved folder, so libraries whose SVG
+    folders overlap share one index (and concurrent callers wait for the
+    first walk instead of repeating it; they report 0 files).
+    """
+    key = str(theme_path.resolve()) + ("!" + theme if theme else "")
+    with _theme_guard:
+        lock = _theme_locks.setdefault(key, threading.Lock())
+
+    def walk(names=None):
+        if theme:
+            return _walk_archive(theme_path, theme, key, names)
+        return _walk_theme(theme_path, key, names)
+
+    with lock:
+        if names is not None:
+            return walk(names)
+        if key in _theme_indexes:
+            return _theme_indexes[key], 0, 0
+        entries, changed, seen = walk()
+        _theme_indexes[key] = entries
+        return entries, changed, seen
+
+
+def svg_manifest_path(key):
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    return CACHE_DIR / "svg-manifests" / "{}.json".format(digest)
+
+
+def svg_manifest(key):
+    """
+    {relative path: {"mtime", "size", "sha256"}} for a theme folder, loaded
+    once per run.  sha256 names the file's bytes in the blob store and is
+    None until the file has been read.
+    """
+    with _theme_guard:
+        if key not in _svg_manifests:
+            try:
+                saved = json.loads(svg_manifest_path(key).read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                saved = {}
+            files = saved.get("files", {}) if saved.get("root") == key else {}
+            _svg_manifests[key] = {"files": files, "dirty": False}
+        return _svg_manifests[key]
+
+
+def save_svg_manifests():
+    """Write back the manifests that gained or lost entries or hashes this run."""
+    with _theme_guard:
+        pending = [(key, manifest, _theme_locks[key]) for key, manifest in _svg_manifests.items()]
+    for key, manifest, lock in pending:
+        with lock:  # not while another library is walking that folder
+            if manifest["dirty"]:
+                manifest["dirty"] = False
+                data = {"root": key, "files": manifest["files"]}
+                write_atomic(svg_manifest_path(key),
+                             json.dumps(data, separators=(",", ":")).encode("utf-8"))
+
+
+def _walk_theme(theme_path, key, names=None):
+    """
+    List the context folders and stat their SVGs on SVG_WORKERS threads.
+
+    Nothing is read here: each stem maps to a handle (path, size, context
+    and its manifest record) and read_svg() loads the text when a
+    thumbnail is actually emitted.  A file whose mtime and size match the
+    manifest keeps its recorded hash, so its text comes from the blob
+    store instead of the (possibly network-mounted) source tree.  Files are
+    taken in sorted path order, so when a stem appears twice the same file
+    wins on every run, whatever the worker count.
+    """
+    manifest = svg_manifest(key)
+    files = manifest["files"]
+    ctx_folders = [p for p in sorted(theme_path.iterdir()) if p.is_dir()]
+    with ThreadPoolExecutor(max_workers=max(1, SVG_WORKERS)) as executor:
+        listings = executor.map(lambda ctx: sorted(ctx.rglob("*.svg")), ctx_folders)
+        listed = [(ctx_folder, svg_file, svg_file.relative_to(theme_path).as_posix())
+                  for ctx_folder, svg_files in zip(ctx_folders, listings)
+                  for svg_file in svg_files
+                  if names is None or svg_file.stem in names]
+        stats = executor.map(lambda f: _stat_svg(f[1], files.get(f[2])), listed)
+
+        entries = {}
+        changed = 0
+        for (ctx_folder, svg_file, rel), record in zip(listed, stats):
+            if record is None:
+                manifest["dirty"] |= files.pop(rel, None) is not None
+                continue
+            if record is not files.get(rel):
+                changed += 1
+                files[rel] = record
+                manifest["dirty"] = True
+            entries[svg_file.stem] = {
+                "path": svg_file,
+                "size": record["size"],
+                "context_raw": ctx_folder.name,
+                "file": record,
+                "manifest": manifest,
+            }
+
+    if names is None:
+        # Only a full walk knows which files are gone.
+        present = {rel for _, _, rel in listed}
+        for rel in [rel for rel in files if rel not in present]:
+            del files[rel]
+            manifest["dirty"] = True
+    return entries, changed, len(listed)
+
+
+def _stat_svg(svg_file, cached):
+    """The manifest record for a file: `cached` if unchanged, else a fresh one."""
+    try:
+        st = svg_file.stat()
+    except OSError:
+        return None
+    if cached and cached["mtime"] == st.st_mtime_ns and cached["size"] == st.st_size:
+        return cached
+    return {"mtime": st.st_mtime_ns, "size": st.st_size, "sha256": None}
+
+
+def read_svg(entry):
+    """
+    Text of an indexed SVG, or None if it cannot be read.  Comes from the
+    blob store when the hash is known; otherwise the file is read once and
+    its bytes stored, and the hash noted in the manifest for later runs.
     """
-    Walk light/dark SVG folders.
+    digest = entry["file"].get("sha256")
+    if digest:
+        try:
+            return blob_path(digest).read_text(encoding="utf-8").strip()
+        except (OSError, ValueError):
+            pass
+    if entry["path"] is None:
+        return None
+    try:
+        data = entry["path"].read_bytes()
+        svg_text = data.decode("utf-8").strip()
+    except (OSError, ValueError):
+        return None
+    entry["file"]["sha256"] = store_blob(data)
+    if entry["manifest"] is not None:
+        entry["manifest"]["dirty"] = True
+    return svg_text
+
+
+# ── Zip / tar archives ──
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+
+def is_archive(path):
+    return path.name.lower().endswith(ARCHIVE_SUFFIXES) and path.is_file()
+
+
+def theme_source(svg_input, dirname):
+    """
+    Where a theme's SVGs live: the folder svg_input/dirname, or a zip/tar
+    archive, either svg_input itself (with a dirname folder somewhere
+    inside) or svg_input/dirname.zip (.tar.gz, ...) in place of the folder.
+    None if there is neither.
+    """
+    if is_archive(svg_input):
+        return svg_input
+    folder = svg_input / dirname
+    if folder.exists():
+        return folder
+    for suffix in ARCHIVE_SUFFIXES:
+        if is_archive(svg_input / (dirname + suffix)):
+            return svg_input / (dirname + suffix)
+    return None
+
+
+def _theme_member(name, theme, per_theme):
+    """
+    An archive member's path relative to the theme folder ("ctx/.../x.svg"),
+    or None if it is not an SVG under a context folder of that theme.
+    A per-theme archive may hold the context folders at its top level.
+    """
+    parts = [p for p in name.split("/") if p not in ("", ".")]
+    if not parts or parts[0] == "__MACOSX" or parts[-1].startswith("._") \
+            or not parts[-1].endswith(".svg"):
+        return None
+    if theme in parts[:-1]:
+        parts = parts[parts.index(theme) + 1:]
+    elif not per_theme:
+        return None
+    return "/".join(parts) if len(parts) > 1 else None
+
+
+def _walk_archive(archive, theme, key, names=None):
+    """
+    _walk_theme for a zip or tar archive, without extracting anything.
+
+    Member records are stamped with the zip CRC-32 or the tar mtime (in
+    place of the file mtime), and members whose text is not in the blob
+    store yet are read during the walk, since an archive cannot be
+    re-opened cheaply per thumbnail.  Zip members are read on SVG_WORKERS
+    threads, each with its own handle on the archive; a tar (compressed or
+    not) can only be read front to back, so it is streamed once while the
+    threads hash and store what it yields.
+    """
+    manifest = svg_manifest(key)
+    files = manifest["files"]
+    per_theme = archive.name.lower() in {(theme + s).lower() for s in ARCHIVE_SUFFIXES}
+    listed = []  # (rel, record)
+    fresh = {}   # rel -> record whose text still has to be read
+
+    def note(rel, stamp, size):
+        cached = files.get(rel)
+        if cached and cached["mtime"] == stamp and cached["size"] == size \
+                and cached["sha256"] and blob_path(cached["sha256"]).exists():
+            record = cached
+        else:
+            record = {"mtime": stamp, "size": size, "sha256": None}
+        listed.append((rel, record))
+        if record["sha256"] is None:
+            fresh[rel] = record
+        return record["sha256"] is None
+
+    def wanted(rel):
+        return names is None or os.path.splitext(rel.rsplit("/", 1)[-1])[0] in names
+
+    def stored(record, data):
+        record["sha256"] = store_blob(data)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, SVG_WORKERS)) as executor:
+            if zipfile.is_zipfile(archive):
+                with zipfile.ZipFile(archive) as zf:
+                    infos = {}
+                    for info in zf.infolist():
+                        rel = _theme_member(info.filename, theme, per_theme)
+                        if rel and wanted(rel) and note(rel, info.CRC, info.file_size):
+                            infos[rel] = info
+                handles = threading.local()
+                opened = []
+
+                def read(rel):
+                    if not hasattr(handles, "zip"):
+                        handles.zip = zipfile.ZipFile(archive)
+                        opened.append(handles.zip)
+                    stored(fresh[rel], handles.zip.read(infos[rel]))
+
+                try:
+                    list(executor.map(read, list(infos)))
+                finally:
+                    for zf in opened:
+                        zf.close()
+            else:
+                with tarfile.open(archive, "r|*") as tar:
+                    pending = []
+                    for info in tar:
+                        rel = _theme_member(info.name, theme, per_theme) if info.isfile() else None
+                        if rel and wanted(rel) and note(rel, int(info.mtime), info.size):
+                            data = tar.extractfile(info).read()
+                            pending.append(executor.submit(stored, fresh[rel], data))
+                    for future in pending:
+                        future.result()
+    except (OSError, EOFError, zlib.error, zipfile.BadZipFile, tarfile.TarError) as exc:
+        print("Warning: cannot read {} ({}) – skipping its SVGs".format(archive, exc))
+        return {}, 0, 0
+
+    entries = {}
+    changed = 0
+    for rel, record in sorted(listed, key=lambda item: item[0]):
+        if record is not files.get(rel):
+            changed += 1
+            files[rel] = record
+            manifest["dirty"] = True
+        name = rel.rsplit("/", 1)[-1]
+        entries[os.path.splitext(name)[0]] = {
+            "path": None,
+            "size": record["size"],
+            "context_raw": rel.split("/", 1)[0],
+            "file": record,
+            "manifest": manifest,
+        }
+
+    if names is None:
+        present = {rel for rel, _ in listed}
+        for rel in [rel for rel in files if rel not in present]:
+            del files[rel]
+            manifest["dirty"] = True
+    return entries, changed, len(listed)
+
+
+def index_svgs(names=None, svg_input=None, quiet=False):
+    """
+    Walk light/dark SVG folders, or read them from zip/tar archives (see
+    theme_source).
     Returns {
-      "light": { "ComponentName16": {"svg": "...", "context": "01_MapView_A"} },
-      "dark":  { "ComponentName16": {"svg": "...", "context": "01_MapView_A_Dark"} }
+      "light": { "ComponentName16": {"path": ..., "size": 812, "context_raw": "01_MapView_A"} },
+      "dark":  { "ComponentName16": {"path": ..., "size": 790, "context_raw": "…_Dark"} },
+      "read":  (files changed since the last run, files seen, seconds)
     }
+    Entries are handles; read_svg() returns their text.  With `names`,
+    only SVGs whose stem is in that set are indexed.  `quiet` leaves the
+    counts to the caller (see print_svg_counts).
     """
+    svg_input = svg_input or SVG_INPUT
     result = {"light": {}, "dark": {}}
+    started = time.monotonic()
+    changed = seen = 0
 
     for dirname, mode in [(LIGHT_DIR, "light"), (DARK_DIR, "dark")]:
-        theme_path = SVG_INPUT / dirname
-        if not theme_path.exists():
-            print("Warning: {} not found – skipping {} thumbnails".format(theme_path, mode))
+        source = theme_source(svg_input, dirname)
+        if source is None:
+            print("Warning: {} not found – skipping {} thumbnails".format(
+                svg_input / dirname, mode))
             continue
+        theme = dirname if is_archive(source) else None
+        result[mode], theme_changed, theme_seen = index_theme(source, names, theme)
+        changed += theme_changed
+        seen += theme_seen
+
+    result["read"] = (changed, seen, time.monotonic() - started)
+    if not quiet:
+        print_svg_counts(result)
+    return result
+
+
+def print_svg_counts(svg_index):
+    print("  Light SVGs: {}".format(len(svg_index["light"])))
+    print("  Dark SVGs:  {}".format(len(svg_index["dark"])))
+    changed, seen, seconds = svg_index["read"]
+    if seen:
+        print("  Indexed {:,} files ({:,} new or changed) in {:.2f}s "
+              "({:,.0f} files/s, {} workers)".format(
+                  seen, changed, seconds, seen / max(seconds, 1e-6), SVG_WORKERS))
+
+
+# ─────────────────────────────────────────────
+# REMOTE SVGs (Figma image export)
+# ─────────────────────────────────────────────
+
+def pick_variants(variants):
+    """Return {"A": light variant, "B": dark variant}, by the same rules as build_icons."""
+    picked = {}
+    for v in variants:
+        mode = classify_mode(parse_variant_props(v["name"]))
+        if mode:
+            picked[mode] = v
+    if not picked and len(variants) == 2:
+        picked = {"A": variants[0], "B": variants[1]}
+    return picked
 
-        for ctx_folder in sorted(theme_path.iterdir()):
-            if not ctx_folder.is_dir():
-                continue
-            for svg_file in ctx_folder.rglob("*.svg"):
-                stem = svg_file.stem
-                try:
-                    svg_text = svg_file.read_text(encoding="utf-8").strip()
-                except Exception:
-                    continue
-                result[mode][stem] = {
-                    "svg": svg_text,
-                    "context_raw": ctx_folder.name,
-                }
+
+def blob_path(digest):
+    return CACHE_DIR / "blobs" / digest[:2] / (digest + ".svg")
+
+
+def store_blob(data):
+    """Write data to the content-addressed store (once) and return its sha256."""
+    digest = hashlib.sha256(data).hexdigest()
+    path = blob_path(digest)
+    if not path.exists():
+        write_atomic(path, data)
+    return digest
+
+
+def download_blob(url):
+    try:
+        resp = scheduled_get(url, {}, throttled=False)
+    except OSError as e:
+        raise FigmaAPIError("cannot download exported image ({}) – {}".format(e, url[:120]))
+    if resp.status != 200:
+        raise FigmaAPIError("image download failed: {} {} – {}".format(
+            resp.status, resp.reason, url[:120]))
+    return store_blob(resp.body)
+
+
+def figma_image_urls(file_key, node_ids):
+    """One /v1/images call: {node_id: svg_url} (nodes Figma could not render are dropped)."""
+    endpoint = "/images/{}?ids={}&format=svg".format(file_key, quote(",".join(node_ids), safe=",:"))
+    data = figma_get(endpoint)
+    if data.get("err"):
+        raise FigmaAPIError("image export for {} failed: {}".format(file_key, data["err"]))
+    return {nid: url for nid, url in (data.get("images") or {}).items() if url}
+
+
+def export_svgs(file_key, nodes):
+    """
+    Return {node_id: blob digest} for nodes ({node_id: updated_at}) of one
+    file.  Nodes whose updated_at matches the last export are served from
+    the blob store; the rest are exported EXPORT_BATCH ids per request and
+    downloaded through a DOWNLOAD_WORKERS pool.
+    """
+    index_path = CACHE_DIR / "svg-exports-{}.json".format(file_key)
+    known = json.loads(index_path.read_text(encoding="utf-8")) if index_path.exists() else {}
+
+    result, todo = {}, []
+    for nid, stamp in nodes.items():
+        entry = known.get(nid)
+        if entry and entry["updated_at"] == stamp and blob_path(entry["hash"]).exists():
+            result[nid] = entry["hash"]
+        else:
+            todo.append(nid)
+    if not todo:
+        print("  {}: {} SVGs unchanged in blob store".format(file_key, len(result)))
+        return result
+    if OFFLINE or (cassette is not None and cassette.replaying):
+        # Export URLs point at Figma's CDN, which a cassette or the cache cannot stand in for.
+        print("  {}: {} SVGs from blob store, {} not there and not downloaded ({})".format(
+            file_key, len(result), len(todo), "--offline" if OFFLINE else "--replay"))
+        return result
+
+    batches = [todo[i:i + EXPORT_BATCH] for i in range(0, len(todo), EXPORT_BATCH)]
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+        urls = {}
+        for batch_urls in executor.map(lambda b: figma_image_urls(file_key, b), batches):
+            urls.update(batch_urls)
+        started = time.monotonic()
+        items = sorted(urls.items())
+        for (nid, _), digest in zip(items, executor.map(lambda i: download_blob(i[1]), items)):
+            result[nid] = digest
+            known[nid] = {"hash": digest, "updated_at": nodes[nid]}
+        elapsed = time.monotonic() - started
+
+    write_atomic(index_path, json.dumps(known, indent=1, sort_keys=True).encode("utf-8"))
+    print("  {}: {} SVGs exported in {} batches, {} downloaded in {:.1f}s, {} reused, "
+          "{} not renderable".format(file_key, len(todo), len(batches), len(urls), elapsed,
+                                     len(nodes) - len(todo), len(todo) - len(urls)))
+    return result
+
+
+def index_figma_svgs(components, sets_dict, file_key, names=None):
+    """
+    Build an index shaped like index_svgs() from Figma itself: the A/B
+    variant of each set becomes its light/dark SVG, standalone components
+    are light only, and the context is the Figma page name.
+    """
+    grouped, standalone = group_components(components, sets_dict)
+    wanted = {}  # node_id -> (mode, name, context, updated_at)
+    for set_nid, variants in grouped.items():
+        si = sets_dict[set_nid]
+        if names is not None and si["name"] not in names:
+            continue
+        page = si.get("containing_frame", {}).get("pageName", "uncategorized")
+        for mode, v in pick_variants(variants).items():
+            wanted[v["node_id"]] = ("light" if mode == "A" else "dark", si["name"], page,
+                                    v.get("updated_at"))
+    for comp in standalone:
+        if names is not None and comp["name"] not in names:
+            continue
+        page = comp.get("containing_frame", {}).get("pageName", "uncategorized")
+        wanted[comp["node_id"]] = ("light", comp["name"], page, comp.get("updated_at"))
+
+    # Team listings qualify node ids as "<file_key>/<node_id>".
+    by_file = {}
+    for nid, info in wanted.items():
+        fkey, _, raw = nid.rpartition("/")
+        by_file.setdefault(fkey or file_key, {})[raw] = (nid, info)
+
+    result = {"light": {}, "dark": {}}
+    for fkey, nodes in sorted(by_file.items()):
+        digests = export_svgs(fkey, {raw: info[3] for raw, (_, info) in nodes.items()})
+        for raw, digest in digests.items():
+            mode, name, page, _ = nodes[raw][1]
+            result[mode][name] = {
+                "path": None,
+                "size": blob_path(digest).stat().st_size,
+                "context_raw": page,
+                "file": {"sha256": digest},
+                "manifest": None,
+            }
 
     print("  Light SVGs: {}".format(len(result["light"])))
     print("  Dark SVGs:  {}".format(len(result["dark"])))
     return result
 
 
+# ─────────────────────────────────────────────
+# SVG MINIFIER
+# ─────────────────────────────────────────────
+
+XML_JUNK_RE = re.compile(r"<\?xml.*?\?>|<!DOCTYPE[^[>]*(?:\[.*?\])?\s*>|<!--.*?-->", re.DOTALL)
+EDITOR_ELEMENT_RE = re.compile(
+    r"<(metadata|title|desc|sodipodi:namedview)\b[^>]*?(?:/>|>.*?</\1\s*>)", re.DOTALL)
+EDITOR_ATTR_RE = re.compile(
+    r"\s(?:(?:inkscape|sodipodi|sketch|serif|i|x):[\w.-]+|xmlns:(?:inkscape|sodipodi|sketch|serif"
+    r"|dc|cc|rdf|i|x|graph)|xml:space|version|data-name|enable-background)=(\"[^\"]*\"|'[^']*')")
+EDITOR_STYLE_RE = re.compile(r"\sstyle=[\"']enable-background:[^;\"']*;?[\"']")
+ROOT_ORIGIN_RE = re.compile(r"(<svg\b[^>]*?)\s[xy]=[\"']0(?:px)?[\"']")
+ID_ATTR_RE = re.compile(r"\sid=(?:\"([^\"]*)\"|'([^']*)')")
+ID_REF_RE = re.compile(r"url\(\s*#([^)\s]+)\s*\)|href=[\"']#([^\"']+)")
+COORD_ATTR_RE = re.compile(
+    r"(\s(d|points|transform|x|y|x1|y1|x2|y2|cx|cy|r|rx|ry|width|height|stroke-width)=)"
+    r"(\"[^\"]*\"|'[^']*')")
+NUMBER_RE = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+PATH_TOKEN_RE = re.compile(r"[MmLlHhVvCcSsQqTtZz]|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+TRANSFORM_RE = re.compile(r"([A-Za-z]+)\s*\(([^()]*)\)")
+PATH_ARITY = {"m": 2, "l": 2, "t": 2, "h": 1, "v": 1, "c": 6, "s": 4, "q": 4}  # numbers per segment
+BETWEEN_TAGS_RE = re.compile(r">\s+<")
+IN_TAG_SPACE_RE = re.compile(r"\s+(?=[^<>]*>)")
+
+
+def format_number(value, precision):
+    """Shortest form of `value` at `precision` decimals: 0.50 -> .5, -0 -> 0."""
+    text = "{:.{}f}".format(round(value, precision), precision)
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    if text in ("-0", ""):
+        return "0"
+    if text.startswith("0."):
+        return text[1:]
+    if text.startswith("-0."):
+        return "-" + text[2:]
+    return text
+
+
+def compact_path(data, precision):
+    """
+    Round path/points numbers and drop every separator the grammar allows
+    ("M 1.00, 2.50 L 3 -4" -> "M1 2.5L3-4").  Relative coordinates are
+    rounded against where the rounded path has put the pen so far, so the
+    error stays within one rounding step instead of adding up segment by
+    segment.  Arcs are left alone: their flags may already be packed
+    ("011") and would not survive tokenising.
+    """
+    if re.search(r"[Aa]", data):
+        return data
+    out = []
+    prev = None
+    cmd, count = "L", 0  # points="…" has no commands: absolute pairs
+    pen, drawn = [0.0, 0.0], [0.0, 0.0]  # exact pen, pen of the rounded path
+    start, drawn_start = [0.0, 0.0], [0.0, 0.0]
+    ends = {}  # axis -> (exact, drawn) for the segment being read
+    for token in PATH_TOKEN_RE.findall(data):
+        if token.isalpha():
+            out.append(token)
+            prev = None
+            cmd, count = token, 0
+            if cmd in "Zz":
+                pen, drawn = start[:], drawn_start[:]
+            continue
+        value = float(token)
+        arity = PATH_ARITY.get(cmd.lower())
+        if arity is None:  # stray numbers after Z
+            token = format_number(value, precision)
+        else:
+            i = count % arity
+            axis = 1 if cmd in "Vv" else 0 if cmd in "Hh" else i % 2
+            relative = cmd.islower()
+            exact = pen[axis] + value if relative else value
+            origin = drawn[axis] if relative else 0.0
+            token = format_number(exact - origin, precision)
+            ends[axis] = (exact, origin + float(token))
+            if i == arity - 1:  # segment complete: both pens move to its end
+                for a, (e, d) in ends.items():
+                    pen[a], drawn[a] = e, d
+                ends.clear()
+                if cmd in "Mm" and count == arity - 1:
+                    start, drawn_start = pen[:], drawn[:]
+            count += 1
+        if prev is not None and not token.startswith("-") \
+                and not (token.startswith(".") and ("." in prev or "e" in prev)):
+            out.append(" ")
+        out.append(token)
+        prev = token
+    return "".join(out)
+
+
+def compact_transform(value, precision):
+    """
+    Round a transform list.  Only lengths (translations, matrix e/f and a
+    rotation's centre) get `precision` decimals; scale, rotate, skew and
+    matrix a-d are factors that multiply every coordinate, so they keep
+    TRANSFORM_PRECISION – scale(.04166667) must not become scale(.04).
+    """
+    fine = max(precision, TRANSFORM_PRECISION)
+    out = []
+    for name, args in TRANSFORM_RE.findall(value):
+        numbers = [float(n) for n in NUMBER_RE.findall(args)]
+        if name == "translate":
+            digits = [precision] * len(numbers)
+        elif name == "matrix":
+            digits = [fine] * 4 + [precision] * 2
+        elif name == "rotate":
+            digits = [fine] + [precision] * 2
+        else:
+            digits = [fine] * len(numbers)
+        out.append("{}({})".format(name, " ".join(
+            format_number(n, p) for n, p in zip(numbers, digits))))
+    if not out or TRANSFORM_RE.sub("", value).replace(",", "").strip():
+        return value  # not a plain transform list; leave it alone
+    return "".join(out)
+
+
+def minify_svg(svg, precision=None):
+    """
+    Strip editor metadata, comments and redundant attributes, round
+    coordinates to `precision` decimals (default SVG_PRECISION) and compact
+    path data.  Purely textual, so unknown markup passes through untouched.
+    """
+    precision = SVG_PRECISION if precision is None else precision
+    # A DOCTYPE declaring entities (Illustrator's &ns_svg; …) has to stay.
+    svg = XML_JUNK_RE.sub(lambda m: m.group(0) if "<!ENTITY" in m.group(0) else "", svg)
+    svg = EDITOR_ELEMENT_RE.sub("", svg)
+    svg = EDITOR_ATTR_RE.sub("", svg)
+    svg = EDITOR_STYLE_RE.sub("", svg)
+    for _ in range(2):  # x="0" and y="0" on the root are the defaults
+        svg = ROOT_ORIGIN_RE.sub(r"\1", svg, count=1)
+    if "xlink:" not in svg.replace("xmlns:xlink", ""):
+        svg = re.sub(r"\sxmlns:xlink=(\"[^\"]*\"|'[^']*')", "", svg)
+    if "<style" not in svg:
+        # ids only matter when something points at them
+        refs = {a or b for a, b in ID_REF_RE.findall(svg)}
+        svg = ID_ATTR_RE.sub(lambda m: m.group(0) if (m.group(1) or m.group(2)) in refs else "",
+                             svg)
+
+    def coords(m):
+        quote, value = m.group(3)[0], m.group(3)[1:-1]
+        if m.group(2) in ("d", "points"):
+            value = compact_path(value, precision)
+        elif m.group(2) == "transform":
+            value = compact_transform(value, precision)
+        else:
+            value = NUMBER_RE.sub(lambda n: format_number(float(n.group(0)), precision), value)
+        return "{}{}{}{}".format(m.group(1), quote, value, quote)
+
+    svg = COORD_ATTR_RE.sub(coords, svg)
+    svg = IN_TAG_SPACE_RE.sub(" ", svg).replace(" />", "/>").replace(" >", ">")
+    if "<text" not in svg:
+        svg = BETWEEN_TAGS_RE.sub("><", svg)
+    return svg.strip()
+
+
+def minify_thumbnails(thumbs_light, thumbs_dark):
+    """Minify freshly built thumbnails in place and report bytes saved per context."""
+    started = time.monotonic()
+    saved = {}  # context key -> [bytes before, bytes after]
+    for thumbs in (thumbs_light, thumbs_dark):
+        for icon_id, svg in thumbs.items():
+            small = minify_svg(svg)
+            thumbs[icon_id] = small
+            totals = saved.setdefault(icon_id.split("/")[1], [0, 0])
+            totals[0] += len(svg.encode("utf-8"))
+            totals[1] += len(small.encode("utf-8"))
+    if not saved:
+        return
+    before = sum(b for b, _ in saved.values())
+    after = sum(a for _, a in saved.values())
+    lines = ["  Minified {} SVGs: {:,} -> {:,} bytes (-{:.1%}) in {:.2f}s".format(
+        len(thumbs_light) + len(thumbs_dark), before, after,
+        (before - after) / max(before, 1), time.monotonic() - started)]
+    for ctx, (b, a) in sorted(saved.items()):
+        lines.append("    {:<32} {:>12,} -> {:>12,}  (-{:.1%})".format(
+            ctx, b, a, (b - a) / max(b, 1)))
+    print("\n".join(lines))
+
+
 # ─────────────────────────────────────────────
 # BUILD ICON RECORDS
 # ─────────────────────────────────────────────
 
-def build_icons(components, sets_dict, svg_index):
+def group_components(components, sets_dict):
+    """Return ({set_node_id: [variant, ...]}, [standalone component, ...])."""
     set_node_ids = set(sets_dict.keys())
 
     # Group variant components by their parent component set.
@@ -222,10 +1733,20 @@ def build_icons(components, sets_dict, svg_index):
             grouped.setdefault(set_nid, []).append(comp)
         else:
             standalone.append(comp)
+    return grouped, standalone
+
+
+def build_icons(components, sets_dict, svg_index):
+    grouped, standalone = group_components(components, sets_dict)
+
+    print("  {} components ({} in sets, {} standalone)".format(
+        sum(len(v) for v in grouped.values()) + len(standalone),
+        sum(len(v) for v in grouped.values()), len(standalone)))
 
     icons = []
     thumbs_light = {}
     thumbs_dark = {}
+    wanted = []  # (icon_id, SVG name) whose thumbnails are read at the end
 
     # ── Component sets (icons with light/dark variants) ──
     for set_nid, variants in grouped.items():
@@ -290,11 +1811,7 @@ def build_icons(components, sets_dict, svg_index):
         }
         icons.append(record)
 
-        # Thumbnails
-        if set_name in svg_index["light"]:
-            thumbs_light[icon_id] = svg_index["light"][set_name]["svg"]
-        if set_name in svg_index["dark"]:
-            thumbs_dark[icon_id] = svg_index["dark"][set_name]["svg"]
+        wanted.append((icon_id, set_name))
 
     # ── Standalone components (no variants) ──
     for comp in standalone:
@@ -333,76 +1850,1624 @@ def build_icons(components, sets_dict, svg_index):
         }
         icons.append(record)
 
-        if comp_name in svg_index["light"]:
-            thumbs_light[icon_id] = svg_index["light"][comp_name]["svg"]
-        if comp_name in svg_index["dark"]:
-            thumbs_dark[icon_id] = svg_index["dark"][comp_name]["svg"]
+        wanted.append((icon_id, comp_name))
 
+    # Thumbnails (read only now that the icons are known to need them)
+    emit_thumbs(wanted, svg_index, thumbs_light, thumbs_dark)
     icons.sort(key=lambda x: x["id"])
+    save_svg_manifests()
     return icons, thumbs_light, thumbs_dark
 
 
+def emit_thumbs(wanted, svg_index, thumbs_light, thumbs_dark):
+    """
+    Read the light/dark SVGs for [(icon_id, name)] into the thumbnail
+    dicts.  The index only stats files, so the reads run here on
+    SVG_WORKERS threads; results are stored in `wanted` order.
+    """
+    jobs = []  # (thumbs, icon_id, entry)
+    for icon_id, name in wanted:
+        for mode, thumbs in (("light", thumbs_light), ("dark", thumbs_dark)):
+            entry = svg_index[mode].get(name)
+            if entry is not None:
+                jobs.append((thumbs, icon_id, entry))
+    with ThreadPoolExecutor(max_workers=max(1, SVG_WORKERS)) as executor:
+        texts = executor.map(read_svg, [entry for _, _, entry in jobs])
+        for (thumbs, icon_id, _), svg_text in zip(jobs, texts):
+            if svg_text is not None:
+                thumbs[icon_id] = svg_text
+
+
+# ─────────────────────────────────────────────
+# THUMBNAIL FALLBACK
+# ─────────────────────────────────────────────
+
+def fallback_thumbnail_path(comp_key, updated_at):
+    stamp = re.sub(r"[^0-9A-Za-z]", "", updated_at or "") or "0"
+    return CACHE_DIR / "thumbnails" / "{}-{}.png".format(comp_key, stamp)
+
+
+def png_as_svg(png, size):
+    """Wrap a PNG so it can sit in the thumbnails files, which hold SVG markup."""
+    size = size or 32
+    return ('<svg xmlns="http://www.w3.org/2000/svg" width="{0}" height="{0}" '
+            'viewBox="0 0 {0} {0}"><image width="{0}" height="{0}" '
+            'href="data:image/png;base64,{1}"/></svg>').format(
+                size, base64.b64encode(png).decode("ascii"))
+
+
+def _fallback_png(source, unreachable):
+    """Return PNG bytes for a component, from the cache or its thumbnail_url."""
+    path = fallback_thumbnail_path(source["key"], source.get("updated_at"))
+    if path.exists():
+        return path.read_bytes(), False
+    if OFFLINE or (cassette is not None and cassette.replaying) or unreachable.is_set():
+        return None, False
+    try:
+        # Thumbnails are a nicety: one retry, and stop trying once the host is down.
+        resp = scheduled_get(source["thumbnail_url"], {}, throttled=False, retries=1)
+    except OSError:
+        unreachable.set()
+        return None, False
+    if resp.status != 200 or not resp.body:
+        return None, False
+    write_atomic(path, resp.body)
+    return resp.body, True
+
+
+def add_fallback_thumbnails(icons, thumbs_light, components, sets_dict):
+    """
+    Give every record without a light SVG the thumbnail Figma renders for
+    its component.  Downloads run through a DOWNLOAD_WORKERS pool and are
+    cached per component key + updated_at, so each image is fetched once.
+    Returns the number of thumbnails added.
+    """
+    sources = {c["node_id"]: c for c in components}
+    sources.update(sets_dict)
+    todo = []
+    for record in icons:
+        if record["id"] in thumbs_light:
+            continue
+        source = sources.get(record["component_id"])
+        if source and source.get("thumbnail_url") and source.get("key"):
+            todo.append((record, source))
+    if not todo:
+        return 0
+
+    started = time.monotonic()
+    added = downloaded = failed = 0
+    unreachable = threading.Event()
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+        futures = [(record, executor.submit(_fallback_png, source, unreachable))
+                   for record, source in todo]
+        for record, future in futures:
+            png, fresh = future.result()
+            if png is None:
+                failed += 1
+                continue
+            thumbs_light[record["id"]] = png_as_svg(png, record["size"])
+            added += 1
+            downloaded += fresh
+    print("  Fallback thumbnails: {} added ({} downloaded, {} cached, {} unavailable) "
+          "in {:.1f}s".format(added, downloaded, added - downloaded, failed,
+                             time.monotonic() - started))
+    return added
+
+
+# ─────────────────────────────────────────────
+# PNG SHARDS AND ATLASES
+# ─────────────────────────────────────────────
+
+# A thumbnail that is already a PNG (see png_as_svg) needs no rendering.
+FALLBACK_PNG_RE = re.compile(
+    r'^<svg [^>]*><image [^>]*href="data:image/png;base64,([A-Za-z0-9+/=]+)"/></svg>$')
+
+
+def render_path(digest, size):
+    return CACHE_DIR / "renders" / digest[:2] / "{}-{}.png".format(digest, size)
+
+
+def _render_png(svg, size):
+    """Process-pool worker: one SVG as a size x size PNG, or None if it cannot be drawn."""
+    try:
+        return cairosvg.svg2png(bytestring=svg.encode("utf-8"),
+                                output_width=size, output_height=size)
+    except Exception:
+        return None
+
+
+def rasterize_thumbnails(thumbs, size=None):
+    """
+    {icon id: svg} -> ({icon id: PNG bytes}, rendered, failed).
+
+    Renders are cached by SVG hash and size in CACHE_DIR/renders, so only
+    new or changed artwork is drawn; that is spread over RENDER_WORKERS
+    processes, each distinct SVG once.
+    """
+    size = size or PNG_SIZE
+    pngs, todo = {}, {}
+    for icon_id, svg in thumbs.items():
+        m = FALLBACK_PNG_RE.match(svg)
+        if m:
+            pngs[icon_id] = base64.b64decode(m.group(1))
+            continue
+        digest = hashlib.sha256(svg.encode("utf-8")).hexdigest()
+        path = render_path(digest, size)
+        if path.exists():
+            pngs[icon_id] = path.read_bytes()
+        else:
+            todo.setdefault(digest, (svg, []))[1].append(icon_id)
+
+    failed = 0
+    if todo:
+        digests = list(todo)
+        with ProcessPoolExecutor(max_workers=RENDER_WORKERS) as executor:
+            renders = executor.map(_render_png, [todo[d][0] for d in digests],
+                                   [size] * len(digests), chunksize=32)
+            for digest, png in zip(digests, renders):
+                if png is None:
+                    failed += len(todo[digest][1])
+                    continue
+                write_atomic(render_path(digest, size), png)
+                for icon_id in todo[digest][1]:
+                    pngs[icon_id] = png
+    return pngs, len(todo), failed
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Everything else (pHYs, sRGB, gAMA, iCCP, tEXt, …) is metadata; tRNS is pixels.
+PNG_KEEP_CHUNKS = (b"IHDR", b"PLTE", b"tRNS", b"IDAT", b"IEND")
+
+
+def png_chunk(tag, body):
+    return (struct.pack(">I", len(body)) + tag + body
+            + struct.pack(">I", zlib.crc32(tag + body) & 0xFFFFFFFF))
+
+
+def _paeth(a, b, c):
+    p = a + b - c
+    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    return b if pb <= pc else c
+
+
+def _unfilter(data, height, stride, bpp):
+    rows = []
+    prev = bytearray(stride)
+    pos = 0
+    for _ in range(height):
+        ftype, line = data[pos], bytearray(data[pos + 1:pos + 1 + stride])
+        pos += 1 + stride
+        if ftype == 1:
+            for i in range(bpp, stride):
+                line[i] = (line[i] + line[i - bpp]) & 0xFF
+        elif ftype == 2:
+            for i in range(stride):
+                line[i] = (line[i] + prev[i]) & 0xFF
+        elif ftype == 3:
+            for i in range(stride):
+                left = line[i - bpp] if i >= bpp else 0
+                line[i] = (line[i] + ((left + prev[i]) >> 1)) & 0xFF
+        elif ftype == 4:
+            for i in range(stride):
+                left, upleft = (line[i - bpp], prev[i - bpp]) if i >= bpp else (0, 0)
+                line[i] = (line[i] + _paeth(left, prev[i], upleft)) & 0xFF
+        elif ftype != 0:
+            raise ValueError("bad PNG filter type {}".format(ftype))
+        rows.append(bytes(line))
+        prev = line
+    return rows
+
+
+def _filter_row(ftype, line, prev, bpp):
+    if ftype == 0:
+        return line
+    lefts = bytes(bpp) + line[:-bpp]
+    if ftype == 1:
+        return bytes((x - a) & 0xFF for x, a in zip(line, lefts))
+    if ftype == 2:
+        return bytes((x - b) & 0xFF for x, b in zip(line, prev))
+    if ftype == 3:
+        return bytes((x - ((a + b) >> 1)) & 0xFF for x, a, b in zip(line, lefts, prev))
+    uplefts = bytes(bpp) + prev[:-bpp]
+    return bytes((x - _paeth(a, b, c)) & 0xFF for x, a, b, c in zip(line, lefts, prev, uplefts))
+
+
+def _deflate_rows(rows, bpp, filters):
+    """Smallest zlib stream over the filter choices (4 = Paeth, "adaptive" = per row)."""
+    best = None
+    for choice in filters:
+        prev = bytes(len(rows[0]))
+        out = bytearray()
+        for line in rows:
+            if choice == "adaptive":
+                # the usual heuristic: least sum of absolute (signed) residuals
+                options = [_filter_row(f, line, prev, bpp) for f in range(5)]
+                ftype = min(range(5), key=lambda f: sum(b if b < 128 else 256 - b
+                                                        for b in options[f]))
+                filtered = options[ftype]
+            else:
+                ftype, filtered = choice, _filter_row(choice, line, prev, bpp)
+            out.append(ftype)
+            out += filtered
+            prev = line
+        for strategy in (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED):
+            packer = zlib.compressobj(9, zlib.DEFLATED, 15, 9, strategy)
+            data = packer.compress(bytes(out)) + packer.flush()
+            if best is None or len(data) < len(best):
+                best = data
+    return best
+
+
+def _pack_bits(indices, depth):
+    """Pack one row of palette indices at 1, 2 or 4 bits per pixel."""
+    per_byte = 8 // depth
+    out = bytearray()
+    for start in range(0, len(indices), per_byte):
+        byte = 0
+        chunk = indices[start:start + per_byte]
+        for n, index in enumerate(chunk):
+            byte |= index << (8 - depth * (n + 1))
+        out.append(byte)
+    return bytes(out)
+
+
+def decode_png(data):
+    """(width, height, [rows of RGBA tuples]) for a non-interlaced 8-bit (or palette) PNG."""
+    if data[:8] != PNG_SIGNATURE:
+        raise ValueError("not a PNG")
+    chunks, pos = [], 8
+    while pos + 8 <= len(data):
+        length, tag = struct.unpack(">I4s", data[pos:pos + 8])
+        chunks.append((tag, data[pos + 8:pos + 8 + length]))
+        pos += 12 + length
+    header = dict(chunks)[b"IHDR"]
+    width, height, depth, ctype, _, _, interlace = struct.unpack(">IIBBBBB", header)
+    if interlace or (depth != 8 and ctype != 3):
+        raise ValueError("unsupported PNG layout")
+    channels = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}[ctype]
+    stride = (width * channels * depth + 7) // 8
+    raw = zlib.decompress(b"".join(body for tag, body in chunks if tag == b"IDAT"))
+    rows = _unfilter(raw, height, stride, max(1, channels * depth // 8))
+
+    palette = dict(chunks).get(b"PLTE", b"")
+    alphas = dict(chunks).get(b"tRNS", b"")
+    if ctype == 3:
+        colors = [tuple(palette[i:i + 3]) + (alphas[i // 3] if i // 3 < len(alphas) else 255,)
+                  for i in range(0, len(palette), 3)]
+        mask, per_byte = (1 << depth) - 1, 8 // depth
+        pixels = [[colors[(row[x // per_byte] >> (8 - depth * (x % per_byte + 1))) & mask]
+                   for x in range(width)] for row in rows]
+    elif ctype in (0, 4):
+        step = channels
+        pixels = [[(row[x], row[x], row[x], row[x + 1] if ctype == 4 else 255)
+                   for x in range(0, width * step, step)] for row in rows]
+        if ctype == 0 and len(alphas) == 2:
+            key = alphas[1]
+            pixels = [[(p[0], p[1], p[2], 0 if p[0] == key else 255) for p in row]
+                      for row in pixels]
+    else:
+        pixels = [[tuple(row[x:x + 3]) + ((row[x + 3],) if ctype == 6 else (255,))
+                   for x in range(0, width * channels, channels)] for row in rows]
+        if ctype == 2 and len(alphas) == 6:
+            key = (alphas[1], alphas[3], alphas[5])
+            pixels = [[p[:3] + ((0,) if p[:3] == key else (255,)) for p in row]
+                      for row in pixels]
+    return width, height, pixels
+
+
+def strip_png(data):
+    """The PNG with only the PNG_KEEP_CHUNKS chunks left."""
+    out, pos = [PNG_SIGNATURE], 8
+    while pos + 8 <= len(data):
+        length, tag = struct.unpack(">I4s", data[pos:pos + 8])
+        if tag in PNG_KEEP_CHUNKS:
+            out.append(data[pos:pos + 12 + length])
+        pos += 12 + length
+    return b"".join(out)
+
+
+def encode_png(width, height, pixels, thorough=True):
+    """
+    The smallest PNG for rows of RGBA tuples: a palette (at the smallest
+    bit depth) or gray / no-alpha where the pixels allow, each filter
+    choice under two zlib strategies at level 9.  Without `thorough`,
+    truecolor only tries per-row adaptive filtering (for large images).
+    """
+    flat = [p for row in pixels for p in row]
+    opaque = all(p[3] == 255 for p in flat)
+    gray = all(p[0] == p[1] == p[2] for p in flat)
+    candidates = []
+
+    counts = {}
+    for p in flat:
+        counts[p] = counts.get(p, 0) + 1
+    if len(counts) <= 256:
+        # translucent entries first so tRNS stays short, then by frequency
+        colors = sorted(counts, key=lambda p: (p[3] == 255, -counts[p], p))
+        index = {p: i for i, p in enumerate(colors)}
+        depth = next(d for d in (1, 2, 4, 8) if len(colors) <= 1 << d)
+        rows = [_pack_bits([index[p] for p in row], depth) if depth < 8
+                else bytes(index[p] for p in row) for row in pixels]
+        extra = png_chunk(b"PLTE", b"".join(bytes(p[:3]) for p in colors))
+        alphas = bytes(p[3] for p in colors if p[3] != 255)
+        if alphas:
+            extra += png_chunk(b"tRNS", alphas)
+        candidates.append((3, depth, rows, 1, extra, (0, "adaptive")))
+
+    if gray:
+        ctype, channels = (0, 1) if opaque else (4, 2)
+    else:
+        ctype, channels = (2, 3) if opaque else (6, 4)
+    rows = [bytes(c for p in row for c in ((p[0],) if gray else p[:3])
+                  + (() if opaque else (p[3],))) for row in pixels]
+    candidates.append((ctype, 8, rows, channels, b"",
+                       (0, 1, 2, 3, 4, "adaptive") if thorough else ("adaptive",)))
+
+    best = None
+    for ctype, depth, rows, bpp, extra, filters in candidates:
+        header = png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, depth, ctype, 0, 0, 0))
+        out = (PNG_SIGNATURE + header + extra
+               + png_chunk(b"IDAT", _deflate_rows(rows, bpp, filters)) + png_chunk(b"IEND", b""))
+        if best is None or len(out) < len(best):
+            best = out
+    return best
+
+
+def optimize_png(data):
+    """
+    Losslessly shrink a PNG: drop ancillary chunks and re-encode the
+    pixels with encode_png.  Returns the smallest of that and the input.
+    """
+    if data[:8] != PNG_SIGNATURE:
+        return data
+    best = strip_png(data)
+    try:
+        encoded = encode_png(*decode_png(data))
+    except (ValueError, KeyError, IndexError, zlib.error, struct.error):
+        encoded = best
+    return min((encoded, best, data), key=len)
+
+
+def optimize_pngs(pngs):
+    """
+    {key: PNG bytes} -> ({key: optimised PNG bytes}, processed).  Results are
+    cached by the input's sha256, and the rest run on RENDER_WORKERS processes.
+    """
+    out, todo = {}, {}
+    for key, png in pngs.items():
+        digest = hashlib.sha256(png).hexdigest()
+        path = CACHE_DIR / "renders" / digest[:2] / "{}-opt.png".format(digest)
+        if path.exists():
+            out[key] = path.read_bytes()
+        else:
+            todo.setdefault(digest, (png, path, []))[2].append(key)
+    if todo:
+        jobs = list(todo.values())
+        with ProcessPoolExecutor(max_workers=RENDER_WORKERS) as executor:
+            for (png, path, keys), small in zip(
+                    jobs, executor.map(optimize_png, [job[0] for job in jobs], chunksize=16)):
+                write_atomic(path, small)
+                for key in keys:
+                    out[key] = small
+    return out, len(todo)
+
+
+def write_png_outputs(thumbs_light, thumbs_dark, output_dir):
+    """
+    Rasterise (and optimise) both themes once, then write whichever of
+    the PNG shards and PNG atlases are enabled.
+    """
+    if cairosvg is None:
+        print("  PNG output skipped: cairosvg is not available (pip install cairosvg; "
+              "it also needs the cairo library)")
+        return
+    for thumbs, suffix, theme in ((thumbs_light, "", "light"), (thumbs_dark, "-dark", "dark")):
+        started = time.monotonic()
+        pngs, rendered, failed = rasterize_thumbnails(thumbs)
+        optimized, processed = optimize_pngs(pngs) if OPTIMIZE_PNGS else (pngs, 0)
+        print("  {} {} PNGs: {} SVGs rendered and {} PNGs optimised on {} processes, "
+              "{} failed; {:,} -> {:,} bytes in {:.2f}s".format(
+                  len(pngs), theme, rendered, processed, RENDER_WORKERS, failed,
+                  sum(map(len, pngs.values())), sum(map(len, optimized.values())),
+                  time.monotonic() - started))
+        if PNG_SHARDS:
+            write_png_shards(pngs, optimized, output_dir / ("thumbs" + suffix))
+        if PNG_ATLASES:
+            write_png_atlases(optimized, output_dir / ("sprites" + suffix))
+
+
+def by_context(pngs):
+    contexts = {}
+    for icon_id in sorted(pngs):
+        contexts.setdefault(icon_id.split("/")[1], {})[icon_id] = pngs[icon_id]
+    return contexts
+
+
+def write_if_changed(path, data):
+    """Write bytes to `path` unless it already holds them; True if written."""
+    if path.exists() and path.read_bytes() == data:
+        return False
+    path.write_bytes(data)
+    return True
+
+
+def remove_stale(directory, keep, pattern):
+    for stale in directory.glob(pattern):
+        if stale.stem not in keep:
+            stale.unlink()
+
+
+def write_png_shards(pngs, optimized, shard_dir):
+    """
+    Write <shard_dir>/<context>.json, each {icon id: PNG data URI}.
+    Shards whose content is unchanged are not rewritten, and shards of
+    contexts that are gone are removed.
+    """
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    contexts = by_context(optimized)
+    written = 0
+    for ctx, shard in contexts.items():
+        text = json.dumps({icon_id: "data:image/png;base64," + base64.b64encode(png).decode("ascii")
+                           for icon_id, png in shard.items()}, separators=(",", ":"))
+        if not write_if_changed(shard_dir / "{}.json".format(ctx), text.encode("utf-8")):
+            continue
+        written += 1
+        if OPTIMIZE_PNGS:
+            before = sum(len(pngs[icon_id]) for icon_id in shard)
+            after = sum(map(len, shard.values()))
+            print("    {}/{}.json: {:,} -> {:,} PNG bytes ({:.1f}% saved)".format(
+                shard_dir.name, ctx, before, after, 100.0 * (before - after) / max(before, 1)))
+    remove_stale(shard_dir, contexts, "*.json")
+    print("  {}/: {} shards, {} written".format(shard_dir.name, len(contexts), written))
+
+
+# ── PNG atlases ──
+
+def png_size(data):
+    """(width, height) from the IHDR of a PNG decode_png can read, else None."""
+    if data[:8] != PNG_SIGNATURE or data[12:16] != b"IHDR":
+        return None
+    width, height, depth, ctype, _, _, interlace = struct.unpack(">IIBBBBB", data[16:29])
+    if interlace or (depth != 8 and ctype != 3):
+        return None
+    return width, height
+
+
+def pack_atlas(sizes):
+    """
+    {icon id: (w, h)} -> (width, height, {icon id: [x, y, w, h]}).  Icons
+    go left to right in id order, onto shelves about as wide as the
+    square root of their total area, so the atlas comes out near square.
+    """
+    limit = max(max(w for w, _ in sizes.values()),
+                int(sum(w * h for w, h in sizes.values()) ** 0.5 + 0.5))
+    x = y = shelf = width = 0
+    boxes = {}
+    for icon_id in sorted(sizes):
+        w, h = sizes[icon_id]
+        if x and x + w > limit:
+            x, y, shelf = 0, y + shelf, 0
+        boxes[icon_id] = [x, y, w, h]
+        x += w
+        shelf = max(shelf, h)
+        width = max(width, x)
+    return width, y + shelf, boxes
+
+
+def _encode_atlas(width, height, cells):
+    """Process-pool worker: paste (PNG, x, y) cells onto a transparent canvas, as a PNG."""
+    canvas = [[(0, 0, 0, 0)] * width for _ in range(height)]
+    for png, x, y in cells:
+        w, h, pixels = decode_png(png)
+        for row, line in enumerate(pixels):
+            canvas[y + row][x:x + w] = line
+    return encode_png(width, height, canvas, thorough=False)
+
+
+def write_png_atlases(pngs, atlas_dir):
+    """
+    Write <atlas_dir>/<context>.png, one image holding every thumbnail of
+    the context, and <context>.json, {"width", "height", "icons": {icon
+    id: [x, y, w, h]}} for CSS background offsets.  Atlases are cached by
+    content and built on RENDER_WORKERS processes; unchanged files are not
+    rewritten and those of contexts that are gone are removed.
+    """
+    started = time.monotonic()
+    atlas_dir.mkdir(parents=True, exist_ok=True)
+    contexts, jobs, skipped = {}, {}, 0
+    for ctx, shard in by_context(pngs).items():
+        sizes = {icon_id: png_size(png) for icon_id, png in shard.items()}
+        skipped += sum(1 for size in sizes.values() if size is None)
+        sizes = {icon_id: size for icon_id, size in sizes.items() if size}
+        if not sizes:
+            continue
+        width, height, boxes = pack_atlas(sizes)
+        index = json.dumps({"width": width, "height": height, "icons": boxes},
+                           separators=(",", ":")).encode("utf-8")
+        digest = hashlib.sha256(index + b"".join(shard[icon_id] for icon_id in sorted(boxes)))
+        path = CACHE_DIR / "renders" / digest.hexdigest()[:2] / "{}-atlas.png".format(
+            digest.hexdigest())
+        contexts[ctx] = (index, path)
+        if not path.exists():
+            jobs[ctx] = (width, height, [(shard[icon_id], x, y)
+                                         for icon_id, (x, y, _, _) in sorted(boxes.items())])
+
+    if jobs:
+        with ProcessPoolExecutor(max_workers=RENDER_WORKERS) as executor:
+            names = list(jobs)
+            for ctx, atlas in zip(names, executor.map(_encode_atlas, *zip(*jobs.values()))):
+                write_atomic(contexts[ctx][1], atlas)
+
+    written = total = 0
+    for ctx, (index, path) in contexts.items():
+        atlas = path.read_bytes()
+        total += len(atlas)
+        written += write_if_changed(atlas_dir / "{}.png".format(ctx), atlas)
+        write_if_changed(atlas_dir / "{}.json".format(ctx), index)
+    remove_stale(atlas_dir, contexts, "*.png")
+    remove_stale(atlas_dir, contexts, "*.json")
+    print("  {}/: {} atlases ({} built, {} written, {:,} bytes){} in {:.2f}s".format(
+        atlas_dir.name, len(contexts), len(jobs), written, total,
+        ", {} PNGs left out (unsupported layout)".format(skipped) if skipped else "",
+        time.monotonic() - started))
+
+
+# ─────────────────────────────────────────────
+# SVG SPRITES
+# ─────────────────────────────────────────────
+
+SVG_ROOT_RE = re.compile(r"\s*<svg\b([^>]*)>(.*)</svg>\s*$", re.DOTALL)
+SVG_ATTR_RE = re.compile(r"([\w:.-]+)=(\"[^\"]*\"|'[^']*')")
+SVG_TAG_RE = re.compile(r"<(/?)([\w:.-]+)[^>]*?(/?)>")
+DEFS_RE = re.compile(r"<defs\b[^>]*?(?:/>|>(.*?)</defs\s*>)", re.DOTALL)
+# Root attributes that describe the document rather than the artwork.
+ROOT_ONLY_ATTRS = ("width", "height", "viewBox", "x", "y", "id", "version")
+
+
+def symbol_id(icon_id, dark=False):
+    """icon/01-map-view/layers/24 -> icon-01-map-view-layers-24 (-dark)."""
+    return re.sub(r"[^A-Za-z0-9_.-]+", "-", icon_id) + ("-dark" if dark else "")
+
+
+def _top_level_elements(markup):
+    """Split markup into its top-level elements; text between them is dropped."""
+    elements, depth, start = [], 0, 0
+    for m in SVG_TAG_RE.finditer(markup):
+        if depth == 0:
+            start = m.start()
+        if m.group(1):
+            depth -= 1
+        elif not m.group(3):
+            depth += 1
+        if depth < 0:
+            raise ValueError("unbalanced markup")
+        if depth == 0:
+            elements.append(markup[start:m.end()])
+    return elements
+
+
+def svg_symbol(svg, sym_id, shared, suffix=""):
+    """
+    One thumbnail as <symbol id="sym_id">, or None when it cannot be one:
+    no <svg> root or size, or a <style> whose rules would apply to every
+    icon in the sprite.  <defs> entries that neither contain nor point at
+    other ids move to `shared` ({id: markup}) under an id derived from
+    their content, so a clip path repeated across icons is written once;
+    every other id gets a sym_id- prefix.
+    """
+    m = SVG_ROOT_RE.match(svg)
+    if not m or "<style" in svg:
+        return None
+    attrs = SVG_ATTR_RE.findall(m.group(1))
+    values = {name: value[1:-1] for name, value in attrs}
+    view_box = values.get("viewBox")
+    if view_box is None:
+        size = [NUMBER_RE.match(values.get(k, "")) for k in ("width", "height")]
+        if not all(size):
+            return None
+        view_box = "0 0 {} {}".format(size[0].group(0), size[1].group(0))
+
+    body, local, renames = m.group(2), [], {}
+    try:
+        defs = [el for block in DEFS_RE.findall(body) for el in _top_level_elements(block)]
+    except ValueError:
+        return None
+    body = DEFS_RE.sub("", body)
+    for el in defs:
+        ids = ID_ATTR_RE.findall(el)
+        if len(ids) == 1 and ID_ATTR_RE.search(el[:el.index(">")]) and not ID_REF_RE.search(el):
+            canonical = ID_ATTR_RE.sub("", el, count=1)
+            shared_id = "d-{}{}".format(
+                hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:10], suffix)
+            shared[shared_id] = ID_ATTR_RE.sub(' id="{}"'.format(shared_id), el, count=1)
+            renames[ids[0][0] or ids[0][1]] = shared_id
+        else:
+            local.append(el)
+    inner = ("<defs>{}</defs>".format("".join(local)) if local else "") + body
+    for a, b in ID_ATTR_RE.findall(inner):
+        renames.setdefault(a or b, "{}-{}".format(sym_id, a or b))
+
+    def rename_id(m):
+        old = m.group(1) or m.group(2)
+        return ' id="{}"'.format(renames.get(old, old))
+
+    def rename_ref(m):
+        old = m.group(1) or m.group(2)
+        if old not in renames:
+            return m.group(0)
+        if m.group(1):
+            return "url(#{})".format(renames[old])
+        return m.group(0)[:6] + "#" + renames[old]
+
+    inner = ID_REF_RE.sub(rename_ref, ID_ATTR_RE.sub(rename_id, inner))
+    kept = "".join(' {}={}'.format(name, value) for name, value in attrs
+                   if name not in ROOT_ONLY_ATTRS and not name.startswith("xmlns"))
+    return '<symbol id="{}" viewBox="{}"{}>{}</symbol>'.format(sym_id, view_box, kept, inner)
+
+
+def build_svg_sprites(thumbs, dark=False):
+    """
+    {icon id: svg} -> ({context: sprite document}, symbols, left out, shared
+    defs).  Symbols are in id order and shared defs in hash order, so a
+    sprite only changes when its icons do.
+    """
+    suffix = "-dark" if dark else ""
+    contexts, skipped = {}, 0
+    for icon_id in sorted(thumbs):
+        ctx = icon_id.split("/")[1]
+        shared, symbols = contexts.setdefault(ctx, ({}, []))
+        symbol = svg_symbol(thumbs[icon_id], symbol_id(icon_id, dark), shared, suffix)
+        if symbol is None:
+            skipped += 1
+        else:
+            symbols.append(symbol)
+
+    sprites = {}
+    for ctx, (shared, symbols) in contexts.items():
+        if not symbols:
+            continue
+        markup = ("<defs>{}</defs>".format("".join(shared[k] for k in sorted(shared)))
+                  if shared else "") + "".join(symbols)
+        sprites[ctx] = '<svg xmlns="http://www.w3.org/2000/svg"{}>{}</svg>'.format(
+            ' xmlns:xlink="http://www.w3.org/1999/xlink"' if "xlink:" in markup else "", markup)
+    return (sprites, sum(len(s) for _, s in contexts.values()), skipped,
+            sum(len(d) for d, _ in contexts.values()))
+
+
+def write_svg_sprites(thumbs_light, thumbs_dark, output_dir):
+    """
+    Write symbols/<context>.svg and symbols-dark/<context>.svg, one
+    <symbol> per icon (see symbol_id) for cards to draw with <use>.
+    Unchanged sprites are not rewritten, and those of contexts that are
+    gone are removed.
+    """
+    for thumbs, dirname, dark in ((thumbs_light, "symbols", False),
+                                  (thumbs_dark, "symbols-dark", True)):
+        started = time.monotonic()
+        sprites, symbols, skipped, shared = build_svg_sprites(thumbs, dark)
+        sprite_dir = output_dir / dirname
+        sprite_dir.mkdir(parents=True, exist_ok=True)
+        written = sum(write_if_changed(sprite_dir / "{}.svg".format(ctx), text.encode("utf-8"))
+                      for ctx, text in sprites.items())
+        remove_stale(sprite_dir, sprites, "*.svg")
+        print("  {}/: {} symbols in {} sprites, {} shared defs, {:,} bytes (vs {:,} inline){}; "
+              "{} written in {:.2f}s".format(
+                  dirname, symbols, len(sprites), shared,
+                  sum(len(text.encode("utf-8")) for text in sprites.values()),
+                  sum(len(svg.encode("utf-8")) for svg in thumbs.values()),
+                  ", {} left out (<style> or no size)".format(skipped) if skipped else "",
+                  written, time.monotonic() - started))
+
+
+# ─────────────────────────────────────────────
+# INCREMENTAL SYNC
+# ─────────────────────────────────────────────
+
+def fetch_file_version(file_key):
+    """Return the library's current version id (a depth=1 file read is cheap)."""
+    data = figma_get("/files/{}?depth=1".format(file_key))
+    return data.get("version")
+
+
+def snapshot_path(file_key):
+    return CACHE_DIR / "snapshot-{}.json".format(file_key)
+
+
+def snapshot_config(lib):
+    """Hash of the settings that shape a library's outputs (besides Figma and the SVGs)."""
+    settings = [SVG_SOURCE, str(lib.svg_input.resolve()) if SVG_SOURCE == "local" else None,
+                LIGHT_DIR, DARK_DIR, MINIFY_SVGS, SVG_PRECISION, TRANSFORM_PRECISION,
+                THUMBNAIL_FALLBACK]
+    return hashlib.sha1(json.dumps(settings).encode("utf-8")).hexdigest()[:16]
+
+
+def load_snapshot(lib):
+    """
+    The last run's snapshot for `lib`, or None if there is none or it was
+    made for another output folder or other settings (its records would
+    not match what is on disk, or what this run would build).
+    """
+    path = snapshot_path(lib.key)
+    if not path.exists():
+        return None
+    try:
+        snapshot = json.loads(path.read_text(encoding="utf-8"))
+    except ValueError:
+        return None
+    if snapshot.get("output_dir") != str(lib.output_dir.resolve()):
+        print("  {}: last run wrote to another folder – full build".format(lib.key))
+        return None
+    if snapshot.get("config") != snapshot_config(lib):
+        print("  {}: settings changed since the last run – full build".format(lib.key))
+        return None
+    return snapshot
+
+
+def save_snapshot(lib, version, fingerprints, svg_prints):
+    snapshot = {"file_key": lib.key, "version": version,
+                "output_dir": str(lib.output_dir.resolve()), "config": snapshot_config(lib),
+                "fingerprints": fingerprints, "svgs": svg_prints}
+    write_atomic(snapshot_path(lib.key), json.dumps(snapshot, indent=1).encode("utf-8"))
+
+
+def svg_fingerprints(svg_index):
+    """
+    {stem: hash} over the light and dark files an index_svgs() result
+    picked for each stem (context, and the manifest's mtime and size), so
+    a run can tell which stems were added, edited, moved or removed.
+    """
+    parts = {}
+    for mode in ("light", "dark"):
+        for stem, handle in svg_index[mode].items():
+            record = handle["file"]
+            parts.setdefault(stem, []).append(
+                [mode, handle["context_raw"], record.get("mtime"), record.get("size")])
+    return {stem: hashlib.sha1(json.dumps(p).encode("utf-8")).hexdigest()[:16]
+            for stem, p in parts.items()}
+
+
+def record_fingerprints(components, sets_dict):
+    """
+    Return {component_id: hash} for every record build_icons would emit,
+    i.e. per component set (covering all its variants) and per standalone
+    component.  A hash changes whenever Figma's updated_at, name, key or
+    page for the set or any of its variants does.
+    """
+    grouped, standalone = group_components(components, sets_dict)
+
+    def digest(comps):
+        parts = []
+        for c in comps:
+            parts.append([c.get("node_id"), c.get("key"), c.get("name"), c.get("updated_at"),
+                          c.get("containing_frame", {}).get("pageName")])
+        return hashlib.sha1(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+    prints = {}
+    for set_nid, variants in grouped.items():
+        prints[set_nid] = digest([sets_dict[set_nid]] + sorted(variants, key=lambda c: c["node_id"]))
+    for comp in standalone:
+        prints[comp["node_id"]] = digest([comp])
+    return prints
+
+
+OUTPUT_FILES = ("icons.json", "thumbnails-packed.json", "thumbnails-dark-packed.json")
+# Flat {icon id: svg} maps at the names installed plugin builds fetch.
+LEGACY_FILES = (None, "thumbnails.json", "thumbnails-dark.json")
+
+
+# Colour values in presentation attributes and style declarations.  ui.html
+# applies palettes with the same expression; keep the two in step.
+COLOR_VALUE_RE = re.compile(
+    r"([\s;\"'])(fill|stroke|stop-color|color|flood-color)(\s*=\s*[\"']|\s*:\s*)"
+    r"(#[0-9a-fA-F]{3,8}|rgba?\([^)]*\)|[a-zA-Z]+)")
+
+
+def recolor_svg(svg, palette):
+    """Swap colour values through `palette` ({old: new})."""
+    return COLOR_VALUE_RE.sub(
+        lambda m: m.group(1) + m.group(2) + m.group(3) + palette.get(m.group(4), m.group(4)),
+        svg)
+
+
+def color_delta(light, dark):
+    """
+    The palette for which recolor_svg(light, palette) == dark exactly, or
+    None when the two differ in more than their fills and strokes.
+    """
+    light_colors = [m.group(4) for m in COLOR_VALUE_RE.finditer(light)]
+    dark_colors = [m.group(4) for m in COLOR_VALUE_RE.finditer(dark)]
+    if len(light_colors) != len(dark_colors):
+        return None
+    palette = {}
+    for old, new in zip(light_colors, dark_colors):
+        if palette.setdefault(old, new) != new:
+            return None  # one light colour turns into two dark ones
+    palette = {old: new for old, new in palette.items() if old != new}
+    if recolor_svg(light, palette) != dark:
+        return None
+    return palette
+
+
+def pack_thumbnails(thumbs, base=None):
+    """
+    {icon id: svg} -> {"blobs": {hash: svg}, "thumbnails": {icon id: hash}},
+    so artwork shared by several icons is stored once.  Hashes are the
+    shortest sha256 prefix (at least 8 hex digits) that is unique within
+    the file; with little duplication, full digests would cost more than
+    the dedup saves.
+
+    With `base` (the light thumbnails, when packing the dark ones), icons
+    whose SVG is the base one with its colours swapped are stored as
+    "recolor": {icon id: n}, n indexing a shared "palettes" list.
+    """
+    palettes, recolor = [], {}
+    if base:
+        seen = {}
+        for icon_id, svg in thumbs.items():
+            palette = color_delta(base[icon_id], svg) if icon_id in base else None
+            if palette is not None:
+                key = json.dumps(palette, sort_keys=True)
+                if key not in seen:
+                    seen[key] = len(palettes)
+                    palettes.append(palette)
+                recolor[icon_id] = seen[key]
+        thumbs = {k: v for k, v in thumbs.items() if k not in recolor}
+
+    digests = {}
+    for svg in thumbs.values():
+        if svg not in digests:
+            digests[svg] = hashlib.sha256(svg.encode("utf-8")).hexdigest()
+    length = 8
+    while len({d[:length] for d in digests.values()}) < len(digests):
+        length += 1
+    blobs = {digest[:length]: svg for svg, digest in digests.items()}
+    ids = {icon_id: digests[svg][:length] for icon_id, svg in thumbs.items()}
+    packed = {"blobs": blobs, "thumbnails": ids}
+    if recolor:
+        packed["palettes"] = palettes
+        packed["recolor"] = recolor
+    return packed
+
+
+def unpack_thumbnails(data, base=None):
+    """Inverse of pack_thumbnails; flat {icon id: svg} files pass through."""
+    if "blobs" not in data or "thumbnails" not in data:
+        return data
+    blobs = data["blobs"]
+    thumbs = {icon_id: blobs[digest] for icon_id, digest in data["thumbnails"].items()}
+    palettes = data.get("palettes", [])
+    for icon_id, n in data.get("recolor", {}).items():
+        if base and icon_id in base:
+            thumbs[icon_id] = recolor_svg(base[icon_id], palettes[n])
+    return thumbs
+
+
+def load_outputs(output_dir):
+    """Return (icons, thumbs_light, thumbs_dark) from output_dir, or None if incomplete."""
+    paths = []
+    for name, legacy in zip(OUTPUT_FILES, LEGACY_FILES):
+        path = output_dir / name
+        if legacy and not path.exists():
+            path = output_dir / legacy  # written before the packed files existed
+        paths.append(path)
+    if not all(p.exists() for p in paths):
+        return None
+    try:
+        icons, light, dark = (json.loads(p.read_text(encoding="utf-8")) for p in paths)
+    except ValueError:
+        return None
+    light = unpack_thumbnails(light)
+    return icons, light, unpack_thumbnails(dark, light)
+
+
+def incremental_build(components, sets_dict, snapshot, previous, indexer, touched=()):
+    """
+    Rebuild only records whose fingerprint changed since `snapshot`, plus
+    the `touched` ones (whose SVGs changed), and merge them into the
+    `previous` outputs.  indexer(names, components) returns the SVG index
+    for just the changed records.  Returns
+    (icons, thumbs_light, thumbs_dark, fingerprints, stats).
+    """
+    components = list(components)
+    prints = record_fingerprints(components, sets_dict)
+    old_prints = snapshot.get("fingerprints", {})
+    changed = {cid for cid, fp in prints.items() if old_prints.get(cid) != fp}
+    svg_only = (set(touched) & set(prints)) - changed
+    changed |= svg_only
+    removed = set(old_prints) - set(prints)
+    stats = {
+        "added": len(changed - set(old_prints)),
+        "changed": len(changed & set(old_prints)),
+        "svg": len(svg_only),
+        "removed": len(removed),
+        "unchanged": len(prints) - len(changed),
+    }
+
+    icons, thumbs_light, thumbs_dark = rebuild_records(
+        components, sets_dict, previous, changed, removed, indexer)
+    return icons, thumbs_light, thumbs_dark, prints, stats
+
+
+def rebuild_records(components, sets_dict, previous, changed, removed, indexer):
+    """
+    Drop the records of `changed` and `removed` component ids from the
+    `previous` outputs and build the `changed` ones afresh.  Returns
+    (icons, thumbs_light, thumbs_dark).
+    """
+    old_icons, old_light, old_dark = previous
+    kept = [r for r in old_icons if r["component_id"] not in changed | removed]
+    kept_ids = {r["id"] for r in kept}
+    thumbs_light = {k: v for k, v in old_light.items() if k in kept_ids}
+    thumbs_dark = {k: v for k, v in old_dark.items() if k in kept_ids}
+
+    if not changed:
+        return kept, thumbs_light, thumbs_dark
+
+    # Only the changed records need their SVGs (and only those are read).
+    sub = [c for c in components
+           if c["node_id"] in changed
+           or (c.get("containing_frame", {}).get("containingComponentSet") or {}).get("nodeId")
+           in changed
+           or c.get("containing_frame", {}).get("nodeId") in changed]
+    names = {sets_dict[cid]["name"] for cid in changed if cid in sets_dict}
+    names.update(c["name"] for c in sub if c["node_id"] in changed)
+    print("  Re-indexing {} SVG names...".format(len(names)))
+    svg_index = indexer(names, sub)
+
+    new_icons, new_light, new_dark = build_icons(sub, sets_dict, svg_index)
+    if MINIFY_SVGS:
+        minify_thumbnails(new_light, new_dark)
+    thumbs_light.update(new_light)
+    thumbs_dark.update(new_dark)
+    icons = kept + new_icons
+    icons.sort(key=lambda x: x["id"])
+    return icons, thumbs_light, thumbs_dark
+
+
+# ─────────────────────────────────────────────
+# WATCH MODE
+# ─────────────────────────────────────────────
+
+# inotify(7) event bits
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+_INOTIFY_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """
+    Recursive inotify watch on a set of folders (Linux, via libc).  poll()
+    returns the changed .svg paths, plus the path of any directory that
+    appeared or went away.
+    """
+
+    name = "inotify"
+
+    def __init__(self, roots):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs = {}
+        for root in roots:
+            self._add_tree(str(root))
+
+    def _add_tree(self, top):
+        """Watch top and its subfolders; returns the SVGs already inside."""
+        found = []
+        for dirpath, _, filenames in os.walk(top):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dirpath), _INOTIFY_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_add_watch failed", dirpath)
+            self.dirs[wd] = dirpath
+            found.extend(os.path.join(dirpath, f) for f in filenames if f.endswith(".svg"))
+        return found
+
+    def poll(self, timeout):
+        changed = set()
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return changed
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+            offset += _INOTIFY_EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            if wd not in self.dirs or not name:
+                continue
+            path = os.path.join(self.dirs[wd], name)
+            if mask & IN_ISDIR:
+                changed.add(path)
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    changed.update(self._add_tree(path))
+            elif name.endswith(".svg"):
+                changed.add(path)
+        return changed
+
+
+class PollingWatcher:
+    """Fallback watcher: rescan the folders and diff (mtime, size) per SVG."""
+
+    name = "polling every {}s".format(WATCH_POLL)
+
+    def __init__(self, roots):
+        self.roots = [str(r) for r in roots]
+        self.state = self._scan()
+
+    def _scan(self):
+        state = {}
+        for root in self.roots:
+            for dirpath, _, filenames in os.walk(root):
+                for f in filenames:
+                    if not f.endswith(".svg"):
+                        continue
+                    path = os.path.join(dirpath, f)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    state[path] = (st.st_mtime_ns, st.st_size)
+        return state
+
+    def poll(self, timeout):
+        time.sleep(max(timeout, WATCH_POLL))
+        state = self._scan()
+        changed = {p for p in state.keys() | self.state.keys()
+                   if state.get(p) != self.state.get(p)}
+        self.state = state
+        return changed
+
+
+def make_watcher(roots):
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(roots)
+        except (OSError, AttributeError) as e:
+            print("  inotify unavailable ({}) – falling back to polling".format(e))
+    return PollingWatcher(roots)
+
+
+def affected_records(components, sets_dict, stems):
+    """Component ids (set or standalone) of the records named by `stems`."""
+    grouped, standalone = group_components(components, sets_dict)
+    ids = {nid for nid in grouped if sets_dict[nid]["name"] in stems}
+    ids.update(c["node_id"] for c in standalone if c["name"] in stems)
+    return ids
+
+
+def watch(libraries, merge=False):
+    """
+    Keep the outputs in step with the SVG folders until interrupted.  A
+    burst of edits is collected until WATCH_DEBOUNCE seconds pass quietly,
+    then only the records named by the changed SVGs are rebuilt and only
+    the output files whose content changed are rewritten.
+    """
+    states = []
+    for lib in libraries:
+        roots = [lib.svg_input / d for d in (LIGHT_DIR, DARK_DIR) if (lib.svg_input / d).is_dir()]
+        components, sets_dict = fetch_library_data(lib)
+        outputs = load_outputs(lib.output_dir)
+        if roots and outputs is not None:
+            states.append({"lib": lib, "roots": [str(r.resolve()) for r in roots],
+                           "components": list(components), "sets": sets_dict,
+                           "outputs": outputs})
+    roots = sorted({r for state in states for r in state["roots"]})
+    if not roots:
+        print("\nNothing to watch: no SVG folders found (archives are not watched).")
+        return
+    watcher = make_watcher(roots)
+    merged = merge_outputs([state["outputs"] for state in states]) if merge else None
+    print("\nWatching {} SVG folders ({}) – Ctrl-C to stop.".format(len(roots), watcher.name))
+
+    try:
+        while True:
+            changed = watcher.poll(WATCH_POLL)
+            if not changed:
+                continue
+            while True:
+                more = watcher.poll(WATCH_DEBOUNCE)
+                if not more:
+                    break
+                changed |= more
+            updated = [state for state in states if watch_update(state, changed)]
+            if merge and updated:
+                outputs = merge_outputs([state["outputs"] for state in states])
+                written = write_outputs(*outputs, OUTPUT_DIR, previous=merged)
+                merged = outputs
+                print("  merged -> {}: wrote {}".format(
+                    OUTPUT_DIR, ", ".join(written) or "nothing"))
+    except KeyboardInterrupt:
+        print("\nStopped watching.")
+
+
+def watch_update(state, changed):
+    """Rebuild one library for a batch of changed paths; returns True if it was affected."""
+    paths = {p for p in changed
+             if any(p == r or p.startswith(r + os.sep) for r in state["roots"])}
+    if not paths:
+        return False
+    started = time.monotonic()
+    lib, components, sets_dict = state["lib"], state["components"], state["sets"]
+    for root in state["roots"]:
+        _theme_indexes.pop(root, None)  # the memoised full walk is stale now
+
+    if all(p.endswith(".svg") for p in paths):
+        stems = {os.path.splitext(os.path.basename(p))[0] for p in paths}
+        ids = affected_records(components, sets_dict, stems)
+    else:
+        # A folder came or went: every record may have moved.
+        ids = set(record_fingerprints(components, sets_dict))
+    print("\n[watch] {}: {} SVG paths changed, rebuilding {} records".format(
+        lib.key, len(paths), len(ids)))
+
+    def indexer(names, changed_components):
+        return index_svgs(names, lib.svg_input, quiet=True)
+
+    icons, thumbs_light, thumbs_dark = rebuild_records(
+        components, sets_dict, state["outputs"], ids, set(), indexer)
+    if THUMBNAIL_FALLBACK:
+        add_fallback_thumbnails(icons, thumbs_light, components, sets_dict)
+    written = write_outputs(icons, thumbs_light, thumbs_dark, lib.output_dir, state["outputs"])
+    state["outputs"] = (icons, thumbs_light, thumbs_dark)
+    print("  wrote {} in {:.2f}s".format(
+        ", ".join(written) or "nothing", time.monotonic() - started))
+    return bool(written)
+
+
 # ─────────────────────────────────────────────
 # MAIN
 # ─────────────────────────────────────────────
 
-def main():
-    if not FIGMA_FILE_KEY:
+def positive_float(text):
+    """argparse type: a float above zero (a rate of 0 would never refill the bucket)."""
+    try:
+        value = float(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError("not a number: {!r}".format(text))
+    if not value > 0:
+        raise argparse.ArgumentTypeError("must be greater than 0, got {}".format(text))
+    return value
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Extract icon metadata and thumbnails from a Figma library.")
+    parser.add_argument(
+        "--max-age", type=float, metavar="SECONDS",
+        help="reuse cached Figma responses younger than this without a request")
+    parser.add_argument(
+        "--offline", action="store_true",
+        help="run entirely from the response cache in {}".format(CACHE_DIR))
+    parser.add_argument(
+        "--cache-dir", type=Path, default=CACHE_DIR,
+        help="where Figma responses are cached (default: %(default)s)")
+    parser.add_argument(
+        "--rate", type=positive_float, default=RATE_LIMIT, metavar="REQ_PER_SEC",
+        help="sustained Figma request rate shared by the whole run (default: %(default)s)")
+    parser.add_argument(
+        "--file-key", action="append", dest="libraries", metavar="KEY[=SVG_INPUT]",
+        help="library to extract; repeat for several (default: FIGMA_FILE_KEY). "
+             "An optional =SVG_INPUT overrides the SVG folder (or archive) for that library")
+    parser.add_argument(
+        "--team", action="append", dest="teams", metavar="TEAM_ID[=SVG_INPUT]",
+        help="also extract a team's published component library (cursor-paginated)")
+    parser.add_argument(
+        "--merge", action="store_true",
+        help="with several libraries, write one merged set of outputs to "
+             "OUTPUT_DIR instead of one folder per file key")
+    parser.add_argument(
+        "--svg-source", choices=("local", "figma"), default=SVG_SOURCE,
+        help="read SVGs from SVG_INPUT, or export them from Figma (default: %(default)s)")
+    parser.add_argument(
+        "--svg-workers", type=int, default=SVG_WORKERS, metavar="N",
+        help="threads reading local SVG files (default: %(default)s)")
+    parser.add_argument(
+        "--svg-precision", type=int, default=SVG_PRECISION, metavar="DECIMALS",
+        help="decimals kept in minified SVG coordinates (default: %(default)s)")
+    parser.add_argument(
+        "--no-minify", action="store_true",
+        help="write thumbnails exactly as read, without minify_svg")
+    parser.add_argument(
+        "--svg-sprites", action="store_true",
+        help="also write each context's thumbnails as one symbols/<context>.svg "
+             "(and symbols-dark/) of <symbol>s to draw with <use>")
+    parser.add_argument(
+        "--png-shards", action="store_true",
+        help="also render {0}px PNGs into per-context thumbs/ and thumbs-dark/ "
+             "shards (needs cairosvg)".format(PNG_SIZE))
+    parser.add_argument(
+        "--png-atlas", action="store_true",
+        help="also pack each context's {0}px PNGs into one sprites/<context>.png "
+             "(and sprites-dark/) with an id -> [x, y, w, h] index (needs "
+             "cairosvg)".format(PNG_SIZE))
+    parser.add_argument(
+        "--no-png-optimize", action="store_true",
+        help="ship PNG shards as rendered, without optimize_png")
+    parser.add_argument(
+        "--no-legacy-thumbnails", action="store_true",
+        help="write only the packed thumbnail files, not the flat thumbnails.json and "
+             "thumbnails-dark.json that plugin builds before the packed format fetch")
+    parser.add_argument(
+        "--no-fallback-thumbnails", action="store_true",
+        help="leave icons without a light SVG unpreviewed instead of using "
+             "Figma's component thumbnail")
+    parser.add_argument(
+        "--full", action="store_true",
+        help="ignore the previous run's snapshot and rebuild every record")
+    parser.add_argument(
+        "--watch", action="store_true",
+        help="after the run, keep watching the SVG folders and rebuild the "
+             "records whose SVGs are added, edited or removed")
+    tape = parser.add_mutually_exclusive_group()
+    tape.add_argument(
+        "--record", type=Path, metavar="DIR",
+        help="copy every Figma response into a cassette directory")
+    tape.add_argument(
+        "--replay", type=Path, metavar="DIR",
+        help="serve Figma responses from a recorded cassette (no token or network)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    global CACHE_DIR, CACHE_MAX_AGE, OFFLINE, SVG_SOURCE, SVG_WORKERS, THUMBNAIL_FALLBACK
+    global MINIFY_SVGS, SVG_PRECISION, SVG_SPRITES, PNG_SHARDS, PNG_ATLASES, OPTIMIZE_PNGS
+    global LEGACY_THUMBNAILS, cassette
+    args = parse_args(argv)
+    CACHE_DIR = args.cache_dir
+    SVG_SOURCE = args.svg_source
+    SVG_WORKERS = args.svg_workers
+    MINIFY_SVGS = not args.no_minify
+    SVG_PRECISION = args.svg_precision
+    SVG_SPRITES = args.svg_sprites
+    PNG_SHARDS = args.png_shards
+    PNG_ATLASES = args.png_atlas
+    OPTIMIZE_PNGS = not args.no_png_optimize
+    LEGACY_THUMBNAILS = not args.no_legacy_thumbnails
+    THUMBNAIL_FALLBACK = not args.no_fallback_thumbnails
+    CACHE_MAX_AGE = args.max_age
+    OFFLINE = args.offline
+    scheduler.rate = args.rate
+
+    try:
+        if args.record or args.replay:
+            cassette = Cassette(args.record or args.replay, replaying=bool(args.replay))
+        libraries = parse_libraries(args.libraries, args.teams, args.merge)
+        if args.watch and SVG_SOURCE != "local":
+            raise FigmaAPIError("--watch needs --svg-source local")
+        run(libraries, full=args.full, merge=args.merge)
+        if args.watch:
+            watch(libraries, merge=args.merge)
+    except FigmaAPIError as e:
+        print("Error: {}".format(e))
+        print("  Figma requests: {}".format(scheduler.summary()))
+        sys.exit(1)
+
+
+# key is the file key, or "team-<id>" for a team library (team_id set).
+Library = namedtuple("Library", "key team_id svg_input output_dir")
+
+
+def parse_libraries(file_specs, team_specs=None, merge=False):
+    """
+    Turn --file-key / --team values ("ID" or "ID=SVG_INPUT") into Library
+    tuples.
+
+    One library writes to OUTPUT_DIR as before; several write to
+    OUTPUT_DIR/<key>/, or with --merge keep their per-library outputs in
+    the cache and only the merged files land in OUTPUT_DIR.
+    """
+    team_specs = team_specs or []
+    file_specs = file_specs or ([] if team_specs else [FIGMA_FILE_KEY])
+    specs = [(s, False) for s in file_specs] + [(s, True) for s in team_specs]
+    libraries = []
+    for spec, is_team in specs:
+        ident, _, svg_input = spec.partition("=")
+        ident = ident.strip()
+        if not ident:
+            raise FigmaAPIError("empty id in {!r}".format(spec))
+        key = "team-{}".format(ident) if is_team else ident
+        if merge:
+            output_dir = CACHE_DIR / "libraries" / key
+        elif len(specs) > 1:
+            output_dir = OUTPUT_DIR / key
+        else:
+            output_dir = OUTPUT_DIR
+        libraries.append(Library(key, ident if is_team else None,
+                                 Path(svg_input) if svg_input else SVG_INPUT, output_dir))
+    return libraries
+
+
+def fetch_library_data(lib):
+    if lib.team_id:
+        return fetch_team_data(lib.team_id)
+    return fetch_figma_data(lib.key)
+
+
+def fetch_library_version(lib):
+    """Team listings have no single version, so they always go through the diff."""
+    if lib.team_id:
+        return None
+    return fetch_file_version(lib.key)
+
+
+def collect(items, into):
+    """Pass items through while keeping a copy, so a stream can be consumed twice."""
+    for item in items:
+        into.append(item)
+        yield item
+
+
+def run(libraries, full=False, merge=False):
+    if not all(lib.key for lib in libraries):
         print("Error: set FIGMA_FILE_KEY in the script (from your Figma file URL).")
         sys.exit(1)
 
     print("=== Figma Icon Extractor ===\n")
 
-    # 1. Index local SVGs
-    print("[1/3] Indexing local SVGs...")
-    svg_index = index_svgs()
+    if len(libraries) == 1:
+        results = [sync_library(libraries[0], full)]
+    else:
+        print("Extracting {} libraries: {}\n".format(
+            len(libraries), ", ".join(lib.key for lib in libraries)))
+        with ThreadPoolExecutor(max_workers=len(libraries)) as executor:
+            results = list(executor.map(lambda lib: sync_library(lib, full), libraries))
+
+    if merge:
+        icons, thumbs_light, thumbs_dark = merge_outputs(results)
+        written = write_outputs(icons, thumbs_light, thumbs_dark, OUTPUT_DIR,
+                                load_outputs(OUTPUT_DIR))
+        print("\n=== Merged {} libraries into {} ({}) ===".format(
+            len(libraries), OUTPUT_DIR, ", ".join(written) or "unchanged"))
+        print_summary(icons, thumbs_light, thumbs_dark)
+
+
+def sync_library(lib, full=False):
+    """Extract one library into lib.output_dir; returns (icons, thumbs_light, thumbs_dark)."""
+    # A replay is for profiling a whole build, so it never short-cuts.
+    replaying = cassette is not None and cassette.replaying
+    snapshot = None if full or replaying else load_snapshot(lib)
+    previous = load_outputs(lib.output_dir) if snapshot else None
+    if previous is not None:
+        return run_incremental(lib, snapshot, previous)
+
+    if SVG_SOURCE == "figma":
+        # SVGs come from the components themselves, so fetch first.
+        print("[1/3] Fetching {} from Figma API...".format(lib.key))
+        version = fetch_library_version(lib)
+        components, sets_dict = fetch_library_data(lib)
+        components = list(components)
+
+        print("\n[2/3] Exporting SVGs for {} from Figma...".format(lib.key))
+        svg_index = index_figma_svgs(components, sets_dict, lib.key)
+        svg_prints = {}  # exported SVGs follow updated_at, which the fingerprints cover
+    else:
+        # 1. Index local SVGs on a worker thread …
+        print("[1/3] Indexing local SVGs for {} in the background...".format(lib.key))
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            indexing = executor.submit(timed, index_svgs, None, lib.svg_input, True)
+
+            # 2. … while the Figma fetch runs here; they meet at build_icons.
+            print("\n[2/3] Fetching {} from Figma API...".format(lib.key))
+            (version, (components, sets_dict)), fetch_time = timed(
+                lambda: (fetch_library_version(lib), fetch_library_data(lib)))
+            svg_index, index_time = indexing.result()
+        print_svg_counts(svg_index)
+        print_overlap(index_time, fetch_time, time.monotonic() - started)
+        svg_prints = svg_fingerprints(svg_index)
+
+    # 3. Build & write (components stream in as they are parsed / paged)
+    print("\n[3/3] Building icon records for {}...".format(lib.key))
+    seen = []
+    icons, thumbs_light, thumbs_dark = build_icons(
+        collect(components, seen), sets_dict, svg_index)
+    if MINIFY_SVGS:
+        minify_thumbnails(thumbs_light, thumbs_dark)
+    if THUMBNAIL_FALLBACK:
+        add_fallback_thumbnails(icons, thumbs_light, seen, sets_dict)
+
+    write_outputs(icons, thumbs_light, thumbs_dark, lib.output_dir)
+    save_snapshot(lib, version, record_fingerprints(seen, sets_dict), svg_prints)
+    print_summary(icons, thumbs_light, thumbs_dark, lib)
+    return icons, thumbs_light, thumbs_dark
+
 
-    # 2. Fetch from Figma
-    print("\n[2/3] Fetching from Figma API...")
-    components, sets_dict = fetch_figma_data()
+def run_incremental(lib, snapshot, previous):
+    if SVG_SOURCE == "local":
+        # Local SVGs change without Figma knowing: stat them (nothing is
+        # read) on a worker thread while the version is checked.
+        print("[1/3] Checking version and SVGs of {}...".format(lib.key))
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            indexing = executor.submit(index_svgs, None, lib.svg_input, True)
+            version = fetch_library_version(lib)
+            svg_index = indexing.result()
+        print_svg_counts(svg_index)
+        svg_prints = svg_fingerprints(svg_index)
+    else:
+        print("[1/3] Checking version of {}...".format(lib.key))
+        version, svg_index, svg_prints = fetch_library_version(lib), None, {}
+    old_svgs = snapshot.get("svgs", {})
+    stems = {stem for stem in set(svg_prints) | set(old_svgs)
+             if svg_prints.get(stem) != old_svgs.get(stem)}
+
+    unchanged = version is not None and version == snapshot.get("version")
+    if unchanged and not stems:
+        print("  {}: version {} and SVGs unchanged since last run – outputs are up to date.".format(
+            lib.key, version))
+        return previous
+    if not unchanged:
+        print("  {}: version {} -> {}".format(lib.key, snapshot.get("version"), version))
+    if stems:
+        print("  {}: {} SVG names added, edited or removed".format(lib.key, len(stems)))
+
+    print("\n[2/3] Fetching {} from Figma API...".format(lib.key))
+    components, sets_dict = fetch_library_data(lib)
+
+    print("\n[3/3] Rebuilding changed records for {}...".format(lib.key))
+    def indexer(names, changed):
+        if SVG_SOURCE == "figma":
+            return index_figma_svgs(changed, sets_dict, lib.key, names)
+        return svg_index  # the walk above; only the rebuilt records' files are read
+
+    components = list(components)
+    touched = affected_records(components, sets_dict, stems)
+    icons, thumbs_light, thumbs_dark, prints, stats = incremental_build(
+        components, sets_dict, snapshot, previous, indexer, touched)
+    print("  {added} added, {changed} changed ({svg} for SVG edits only), {removed} removed, "
+          "{unchanged} unchanged".format(**stats))
+    if THUMBNAIL_FALLBACK:
+        add_fallback_thumbnails(icons, thumbs_light, components, sets_dict)
+
+    write_outputs(icons, thumbs_light, thumbs_dark, lib.output_dir, previous)
+    save_snapshot(lib, version, prints, svg_prints)
+    print_summary(icons, thumbs_light, thumbs_dark, lib)
+    return icons, thumbs_light, thumbs_dark
 
-    # 3. Build & write
-    print("\n[3/3] Building icon records...")
-    icons, thumbs_light, thumbs_dark = build_icons(components, sets_dict, svg_index)
 
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+def timed(fn, *args):
+    """Call fn(*args); returns (result, seconds)."""
+    started = time.monotonic()
+    result = fn(*args)
+    return result, time.monotonic() - started
 
-    icons_path = OUTPUT_DIR / "icons.json"
-    icons_path.write_text(
-        json.dumps(icons, ensure_ascii=False, indent=2), encoding="utf-8"
-    )
 
-    thumbs_path = OUTPUT_DIR / "thumbnails.json"
-    thumbs_path.write_text(
-        json.dumps(thumbs_light, ensure_ascii=False), encoding="utf-8"
-    )
+def print_overlap(index_time, fetch_time, wall):
+    critical = "SVG index" if index_time >= fetch_time else "Figma fetch"
+    print("  SVG index {:.2f}s | Figma fetch {:.2f}s -> {:.2f}s wall "
+          "(critical path: {}, {:.2f}s saved)".format(
+              index_time, fetch_time, wall, critical, max(0.0, index_time + fetch_time - wall)))
 
-    dark_path = OUTPUT_DIR / "thumbnails-dark.json"
-    dark_path.write_text(
-        json.dumps(thumbs_dark, ensure_ascii=False), encoding="utf-8"
-    )
 
-    # ── Summary ──
+def merge_outputs(results):
+    """
+    Combine per-library (icons, thumbs_light, thumbs_dark).  On an id
+    clash the later library wins the whole entry – record and both
+    thumbnails – so one icon never pairs one library's light thumbnail
+    with another's dark one.
+    """
+    by_id = {}
+    thumbs_light, thumbs_dark = {}, {}
+    clashes = 0
+    for icons, light, dark in results:
+        for record in icons:
+            icon_id = record["id"]
+            if icon_id in by_id:
+                clashes += 1
+            by_id[icon_id] = record
+            for merged, thumbs in ((thumbs_light, light), (thumbs_dark, dark)):
+                if icon_id in thumbs:
+                    merged[icon_id] = thumbs[icon_id]
+                else:
+                    merged.pop(icon_id, None)
+    if clashes:
+        print("Warning: {} icon ids appear in more than one library".format(clashes))
+    return sorted(by_id.values(), key=lambda x: x["id"]), thumbs_light, thumbs_dark
+
+
+def write_outputs(icons, thumbs_light, thumbs_dark, output_dir, previous=None):
+    """
+    Write icons.json and the packed thumbnail files, plus (with
+    LEGACY_THUMBNAILS) the flat ones.  With `previous` (the outputs
+    already on disk), files whose content is unchanged are left alone.
+    Returns the names written.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    written = []
+    outputs = zip(OUTPUT_FILES, LEGACY_FILES, (icons, thumbs_light, thumbs_dark))
+    for n, (name, legacy, data) in enumerate(outputs):
+        legacy = legacy if LEGACY_THUMBNAILS else None
+        # The dark file is stored partly as recolourings of the light one.
+        unchanged = previous is not None and previous[n] == data \
+            and (n < 2 or previous[1] == thumbs_light) and (output_dir / name).exists()
+        if unchanged and (legacy is None or (output_dir / legacy).exists()):
+            continue
+        if name == "icons.json":
+            text = json.dumps(data, ensure_ascii=False, indent=2)
+        elif n == 2:
+            text = json.dumps(pack_thumbnails(data, thumbs_light), ensure_ascii=False)
+        else:
+            text = json.dumps(pack_thumbnails(data), ensure_ascii=False)
+        (output_dir / name).write_text(text, encoding="utf-8")
+        written.append(name)
+        if legacy:
+            (output_dir / legacy).write_text(json.dumps(data, ensure_ascii=False),
+                                             encoding="utf-8")
+            written.append(legacy)
+    missing = (PNG_SHARDS and not (output_dir / "thumbs").is_dir()) \
+        or (PNG_ATLASES and not (output_dir / "sprites").is_dir())
+    if (PNG_SHARDS or PNG_ATLASES) and (previous is None or missing
+                                        or set(written) & set(OUTPUT_FILES[1:])):
+        write_png_outputs(thumbs_light, thumbs_dark, output_dir)
+    if SVG_SPRITES and (previous is None or not (output_dir / "symbols").is_dir()
+                        or set(written) & set(OUTPUT_FILES[1:])):
+        write_svg_sprites(thumbs_light, thumbs_dark, output_dir)
+    return written
+
+
+def print_summary(icons, thumbs_light, thumbs_dark, lib=None):
     matched_light = sum(1 for i in icons if i["id"] in thumbs_light)
     matched_dark = sum(1 for i in icons if i["id"] in thumbs_dark)
     with_b = sum(1 for i in icons if "B" in i.get("variant_keys", {}))
 
-    print("\n=== Done ===")
-    print("  icons.json:            {} icons".format(len(icons)))
-    print("  thumbnails.json:       {} light SVGs".format(len(thumbs_light)))
-    print("  thumbnails-dark.json:  {} dark SVGs".format(len(thumbs_dark)))
-    print("")
-    print("  Variant B (dark) keys: {}/{}".format(with_b, len(icons)))
-    print("  Light thumb match:     {}/{}".format(matched_light, len(icons)))
-    print("  Dark thumb match:      {}/{}".format(matched_dark, len(icons)))
+    # Built up and printed in one go so parallel libraries don't interleave.
+    lines = []
+    if lib is None:
+        lines.append("\n=== Done ===")
+    else:
+        lines.append("\n=== Done: {} -> {} ===".format(lib.key, lib.output_dir))
+    lines.append("  icons.json:                  {} icons".format(len(icons)))
+    lines.append("  thumbnails-packed.json:      {} light SVGs{}".format(
+        len(thumbs_light), dedup_summary(thumbs_light)))
+    packed_dark = pack_thumbnails(thumbs_dark, thumbs_light)
+    lines.append("  thumbnails-dark-packed.json: {} dark SVGs{}, {} as colour swaps of light".format(
+        len(thumbs_dark), dedup_summary(thumbs_dark, packed_dark),
+        len(packed_dark.get("recolor", {}))))
+    lines.append("")
+    lines.append("  Variant B (dark) keys: {}/{}".format(with_b, len(icons)))
+    lines.append("  Light thumb match:     {}/{}".format(matched_light, len(icons)))
+    lines.append("  Dark thumb match:      {}/{}".format(matched_dark, len(icons)))
+    lines.append("  Figma requests:        {}".format(scheduler.summary()))
 
     unmatched = [i for i in icons if i["id"] not in thumbs_light]
     if unmatched:
-        print("\n  Unmatched (no light SVG):")
+        lines.append("\n  Unmatched (no light SVG):")
         for i in unmatched[:10]:
-            print("    - {}".format(i["component_name"]))
+            lines.append("    - {}".format(i["component_name"]))
         if len(unmatched) > 10:
-            print("    ... and {} more".format(len(unmatched) - 10))
+            lines.append("    ... and {} more".format(len(unmatched) - 10))
+    print("\n".join(lines))
+
+
+def dedup_summary(thumbs, packed=None):
+    """
+    ', N unique (1.23x, 456 KB saved)' for a thumbnail map: the full SVG
+    bytes against what `packed` (pack_thumbnails(thumbs) by default)
+    stores – unique blobs, plus palettes and entries for colour swaps.
+    """
+    if not thumbs:
+        return ""
+    if packed is None:
+        packed = pack_thumbnails(thumbs)
+    total = sum(len(svg.encode("utf-8")) for svg in thumbs.values())
+    stored = sum(len(svg.encode("utf-8")) for svg in packed["blobs"].values())
+    if "recolor" in packed:
+        stored += len(json.dumps([packed["palettes"], packed["recolor"]],
+                                 ensure_ascii=False).encode("utf-8"))
+    return ", {} unique ({:.2f}x, {:,} KB saved)".format(
+        len(packed["blobs"]), total / max(stored, 1), (total - stored) // 1024)
 
 
 if __name__ == "__main__":
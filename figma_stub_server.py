@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+"""
+Stand-in Figma API server
+
+A stdlib-only HTTP server that answers the Figma REST endpoints used by
+extract_icons.py, from recorded fixtures or synthetic data, with knobs
+for latency, bandwidth and fault injection:
+
+  GET /v1/files/{key}?depth=1          (name, version, lastModified)
+  GET /v1/files/{key}/components
+  GET /v1/files/{key}/component_sets
+  GET /v1/teams/{id}/components?page_size=N&after=CURSOR
+  GET /v1/teams/{id}/component_sets?page_size=N&after=CURSOR
+  GET /v1/images/{key}?ids=A,B&format=svg   (URLs served by /_export/…)
+  GET /_thumb/{id}.png                       (synthetic component thumbnails)
+
+Usage:
+  python3 figma_stub_server.py --synthetic 12500 --latency 150 --bandwidth 2048
+  python3 figma_stub_server.py --fixtures tapes/2024-06 --rate-429 0.2 --truncate 0.05
+  python3 figma_stub_server.py --synthetic 5000 --team 42 --team-files 3
+
+  export FIGMA_API_URL=http://127.0.0.1:8765/v1
+  export FIGMA_TOKEN=stub
+  python3 extract_icons.py
+
+--fixtures takes a cassette directory written by `extract_icons.py --record`.
+Responses carry an ETag and honour If-None-Match, and are gzip/deflate
+encoded when the client asks for it.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+# ─────────────────────────────────────────────
+# DATA
+# ─────────────────────────────────────────────
+
+WORDS = [
+    "Map", "Layer", "Feature", "Raster", "Table", "Field", "Query", "Select",
+    "Edit", "Vertex", "Line", "Polygon", "Point", "Scene", "Globe", "Camera",
+    "Measure", "Route", "Network", "Topology", "Symbol", "Label", "Legend",
+    "Export", "Import", "Share", "Sync", "Locate", "Buffer", "Clip",
+]
+
+CONTEXTS = [
+    "01_MapView", "02_LayoutView", "03_TableView", "05_Geoprocessing",
+    "06_Editing", "08_Layers", "21_Raster", "26_3DAnalyst",
+]
+
+FILE_KEY = "stubFileKey000000000000"
+THUMB_BASE = "https://s3-alpha.figma.com/thumbnails/"
+
+
+def synthetic_library(count, seed=0, file_key=FILE_KEY, thumb_base=THUMB_BASE):
+    """
+    Return {endpoint: document} for a library of `count` icons shaped like
+    Figma's responses: most icons are component sets with Mode=A / Mode=B
+    variants, every tenth is a standalone component.  thumbnail_url values
+    start with `thumb_base`; point it at a running stub to serve them.
+    """
+    rng = random.Random(seed)
+    components, sets = [], []
+    user = {"id": "1", "handle": "Stub Designer", "img_url": "https://example.com/u.png"}
+    for i in range(count):
+        page = CONTEXTS[i % len(CONTEXTS)]
+        name = "{}{}{}{}".format(rng.choice(WORDS), rng.choice(WORDS), _alpha(i),
+                                 rng.choice((16, 24, 32)))
+        stamp = "2024-{:02d}-{:02d}T12:00:00.000Z".format(rng.randint(1, 12), rng.randint(1, 28))
+        frame = {"name": page, "nodeId": "2:{}".format(i % len(CONTEXTS)),
+                 "pageId": "0:{}".format(i % len(CONTEXTS)), "pageName": page}
+        common = {"file_key": file_key, "description": "", "created_at": "2023-01-01T00:00:00.000Z",
+                  "updated_at": stamp, "user": user}
+        if i % 10 == 9:
+            components.append(dict(common, key=_key("c", i), node_id="1:{}".format(i), name=name,
+                                   thumbnail_url=_thumb(thumb_base, i), containing_frame=frame))
+            continue
+        set_id = "3:{}".format(i)
+        sets.append(dict(common, key=_key("s", i), node_id=set_id, name=name,
+                         thumbnail_url=_thumb(thumb_base, i), containing_frame=frame))
+        for mode in ("A", "B"):
+            variant_frame = dict(frame, containingComponentSet={"name": name, "nodeId": set_id})
+            components.append(dict(common, key=_key(mode, i), node_id="4:{}{}".format(i, mode),
+                                   name="Mode={}".format(mode), thumbnail_url=_thumb(thumb_base, i),
+                                   containing_frame=variant_frame))
+    envelope = {"status": 200, "error": False}
+    pages = [{"id": "0:{}".format(i), "name": page, "type": "CANVAS"}
+             for i, page in enumerate(CONTEXTS)]
+    return {
+        "/files/{}".format(file_key): {
+            "name": "Stub Icons",
+            "lastModified": "2024-06-01T12:00:00Z",
+            "version": str(1000 + seed),
+            "document": {"id": "0:0", "name": "Document", "type": "DOCUMENT", "children": pages},
+        },
+        "/files/{}/components".format(file_key):
+            dict(envelope, meta={"components": components}),
+        "/files/{}/component_sets".format(file_key):
+            dict(envelope, meta={"component_sets": sets}),
+    }
+
+
+def _alpha(i):
+    """0 -> 'A', 25 -> 'Z', 26 -> 'Ba' … – unique, digit-free name suffixes."""
+    out = chr(ord("A") + i % 26)
+    i //= 26
+    while i:
+        out += chr(ord("a") + i % 26)
+        i //= 26
+    return out
+
+
+def _key(prefix, i):
+    return hashlib.sha1("{}{}".format(prefix, i).encode()).hexdigest()
+
+
+def _thumb(base, i):
+    return "{}{:08x}.png".format(base, i)
+
+
+def synthetic_svg(node_id):
+    """
+    A small deterministic icon; the dark (B) variant is the light (A) one
+    with a light fill, as in most real libraries.
+    """
+    h = hashlib.sha1(node_id.rstrip("AB").encode()).digest()
+    fill = "#{:02x}{:02x}{:02x}".format(*(b | 0xC0 for b in h[:3])) if node_id.endswith("B") \
+        else "#{:02x}{:02x}{:02x}".format(*(b & 0x3F for b in h[:3]))
+    r = 2 + h[3] % 5
+    return ('<svg xmlns="http://www.w3.org/2000/svg" width="16" height="16" viewBox="0 0 16 16">'
+            '<rect x="1" y="1" width="14" height="14" rx="{}" fill="{}"/>'
+            '<circle cx="8" cy="8" r="{}" fill="#ffffff"/></svg>').format(h[4] % 4, fill, r)
+
+
+def team_listing(routes):
+    """Collect every file's components and sets from `routes` into one team listing."""
+    team = {"components": [], "component_sets": []}
+    for endpoint, doc in sorted(routes.items()):
+        for kind in team:
+            if endpoint.endswith("/" + kind):
+                team[kind].extend(doc["meta"][kind])
+    return team
+
+
+def load_fixtures(root):
+    """
+    Return {endpoint: body bytes} from a cassette directory.  A file whose
+    /files/{key}?depth=1 version check was not recorded gets one, with a
+    version derived from its recorded listings, so the extractor's
+    incremental runs work against any cassette.
+    """
+    root = Path(root)
+    manifest = json.loads((root / "cassette.json").read_text(encoding="utf-8"))
+    routes = {ep: (root / e["file"]).read_bytes() for ep, e in manifest["entries"].items()}
+    for endpoint in sorted(routes):
+        m = re.match(r"^/files/([^/?]+)/components$", endpoint)
+        if not m or "/files/{}?depth=1".format(m.group(1)) in routes:
+            continue
+        listings = [routes.get("/files/{}/{}".format(m.group(1), kind), b"")
+                    for kind in ("components", "component_sets")]
+        routes["/files/{}?depth=1".format(m.group(1))] = json.dumps({
+            "name": m.group(1),
+            "lastModified": "1970-01-01T00:00:00Z",
+            "version": hashlib.sha1(b"".join(listings)).hexdigest()[:10],
+        }).encode("utf-8")
+    return routes
+
+
+# ─────────────────────────────────────────────
+# SERVER
+# ─────────────────────────────────────────────
+
+class StubConfig:
+    def __init__(self, latency=0.0, jitter=0.0, bandwidth=0, rate_429=0.0, rate_5xx=0.0,
+                 truncate=0.0, retry_after=1, require_token=True, verbose=False, seed=None):
+        self.latency = latency          # seconds before the first byte
+        self.jitter = jitter            # ± seconds added to latency
+        self.bandwidth = bandwidth      # bytes per second, 0 = unlimited
+        self.rate_429 = rate_429        # probability of a 429
+        self.rate_5xx = rate_5xx        # probability of a 500/502/503
+        self.truncate = truncate        # probability of cutting a body short
+        self.retry_after = retry_after  # Retry-After sent with 429s (None to omit)
+        self.require_token = require_token
+        self.verbose = verbose
+        self.seed = seed
+
+
+class FigmaStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, routes, config=None):
+        super().__init__(address, FigmaStubHandler)
+        self.config = config or StubConfig()
+        self.rng = random.Random(self.config.seed)
+        self.rng_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "200": 0, "304": 0, "429": 0, "5xx": 0,
+                      "truncated": 0, "bytes_sent": 0}
+        self.routes = {}
+        self.teams = {}
+        for endpoint, body in routes.items():
+            self.set_route(endpoint, body)
+
+    def set_team(self, team_id, listing):
+        """Serve {"components": [...], "component_sets": [...]} as a paginated team library."""
+        self.teams[str(team_id)] = listing
+
+    def set_route(self, endpoint, body):
+        """Serve `body` (bytes or a JSON-able object) at /v1<endpoint>."""
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.routes["/v1" + endpoint] = {
+            "identity": body,
+            "etag": '"{}"'.format(hashlib.sha1(body).hexdigest()[:20]),
+        }
+
+    def roll(self, probability):
+        if probability <= 0:
+            return False
+        with self.rng_lock:
+            return self.rng.random() < probability
+
+    def count(self, key, n=1):
+        with self.stats_lock:
+            self.stats[key] += n
+
+
+class FigmaStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FigmaStub/1"
+    disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+    def do_GET(self):
+        server, cfg = self.server, self.server.config
+        server.count("requests")
+        delay = cfg.latency
+        if cfg.jitter:
+            with server.rng_lock:
+                delay += server.rng.uniform(-cfg.jitter, cfg.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        if self.path.startswith("/_export/"):
+            return self._send_svg()  # a CDN URL, no token involved
+        if self.path.startswith("/_thumb/"):
+            return self._send_png()
+        if cfg.require_token and not self.headers.get("X-Figma-Token"):
+            return self._send_json(403, {"status": 403, "err": "Invalid token"})
+        # Cassettes keep query strings (?depth=1, ?ids=…): the exact request first.
+        route = (server.routes.get(self.path) or server.routes.get(self.path.split("?", 1)[0])
+                 or self._team_page() or self._image_urls())
+        if route is None:
+            return self._send_json(404, {"status": 404, "err": "Not found"})
+
+        if server.roll(cfg.rate_429):
+            server.count("429")
+            extra = {} if cfg.retry_after is None else {"Retry-After": str(cfg.retry_after)}
+            return self._send_json(429, {"status": 429, "err": "Rate limit exceeded"}, extra)
+        if server.roll(cfg.rate_5xx):
+            server.count("5xx")
+            with server.rng_lock:
+                code = server.rng.choice((500, 502, 503))
+            return self._send_json(code, {"status": code, "err": "Upstream error"})
+
+        if self.headers.get("If-None-Match") == route["etag"]:
+            server.count("304")
+            self.send_response(304)
+            self.send_header("ETag", route["etag"])
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        encoding = negotiate(self.headers.get("Accept-Encoding", ""))
+        body = encoded(route, encoding)
+        server.count("200")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", route["etag"])
+        if encoding != "identity":
+            self.send_header("Content-Encoding", encoding)
+        self.end_headers()
+
+        if server.roll(cfg.truncate):
+            server.count("truncated")
+            self._write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        self._write(body)
+
+    def _team_page(self):
+        """Build a route for /v1/teams/{id}/{kind}; the cursor is a plain offset."""
+        parts = urlsplit(self.path)
+        m = re.match(r"^/v1/teams/([^/]+)/(components|component_sets)$", parts.path)
+        if not m or m.group(1) not in self.server.teams:
+            return None
+        items = self.server.teams[m.group(1)][m.group(2)]
+        query = parse_qs(parts.query)
+        size = int(query.get("page_size", ["30"])[0])
+        start = int(query.get("after", ["0"])[0])
+        page = items[start:start + size]
+        cursor = {"before": start}
+        if start + size < len(items):
+            cursor["after"] = start + size
+        body = json.dumps({"status": 200, "error": False,
+                           "meta": {m.group(2): page, "cursor": cursor}}).encode("utf-8")
+        return {"identity": body, "etag": '"{}"'.format(hashlib.sha1(body).hexdigest()[:20])}
+
+    def _image_urls(self):
+        """/v1/images/{key}?ids=…&format=svg -> URLs pointing back at this server."""
+        parts = urlsplit(self.path)
+        m = re.match(r"^/v1/images/([^/]+)$", parts.path)
+        if not m:
+            return None
+        ids = parse_qs(parts.query).get("ids", [""])[0].split(",")
+        base = "http://{}/_export/{}/".format(self.headers.get("Host"), m.group(1))
+        images = {nid: base + nid.replace(":", "-") + ".svg" for nid in ids if nid}
+        body = json.dumps({"err": None, "images": images}).encode("utf-8")
+        return {"identity": body, "etag": '"{}"'.format(hashlib.sha1(body).hexdigest()[:20])}
+
+    def _send_svg(self):
+        body = synthetic_svg(self.path.rsplit("/", 1)[-1][:-4]).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "image/svg+xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self._write(body)
+
+    def _send_png(self):
+        body = synthetic_png(self.path.rsplit("/", 1)[-1])
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self._write(body)
+
+    def _send_json(self, code, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self._write(body)
+
+    def _write(self, data):
+        bandwidth = self.server.config.bandwidth
+        step = 16 * 1024
+        for i in range(0, len(data), step):
+            chunk = data[i:i + step]
+            self.wfile.write(chunk)
+            self.server.count("bytes_sent", len(chunk))
+            if bandwidth:
+                time.sleep(len(chunk) / bandwidth)
+
+    def log_message(self, fmt, *args):
+        if self.server.config.verbose:
+            super().log_message(fmt, *args)
+
+
+def negotiate(accept):
+    """Pick gzip or deflate if the client lists it (q=0 excluded), else identity."""
+    offered = {}
+    for part in accept.split(","):
+        m = re.match(r"\s*([\w-]+)\s*(?:;\s*q=([\d.]+))?", part)
+        if m:
+            offered[m.group(1).lower()] = float(m.group(2) or 1)
+    for name in ("gzip", "deflate"):
+        if offered.get(name, 0) > 0:
+            return name
+    return "identity"
+
+
+def encoded(route, encoding):
+    """Compressed bodies are built once per route and reused, like a CDN would."""
+    if encoding not in route:
+        raw = route["identity"]
+        if encoding == "gzip":
+            route[encoding] = gzip.compress(raw, compresslevel=6)
+        else:
+            route[encoding] = zlib.compress(raw, 6)
+    return route[encoding]
+
+
+def start(routes, config=None, host="127.0.0.1", port=0):
+    """Start a stub server on a background thread; returns it (see .server_port)."""
+    server = FigmaStubServer((host, port), routes, config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def synthetic_png(name, size=32):
+    """A flat-coloured RGB PNG, the colour derived from `name`."""
+    rgb = bytes(b & 0x7F for b in hashlib.sha1(name.encode()).digest()[:3])
+    raw = (b"\x00" + rgb * size) * size
+
+    def chunk(tag, data):
+        return (struct.pack(">I", len(data)) + tag + data
+                + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF))
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw, 9)) + chunk(b"IEND", b""))
+
+
+# ─────────────────────────────────────────────
+# MAIN
+# ─────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in Figma API server.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--fixtures", type=Path, metavar="DIR",
+                        help="cassette directory recorded with extract_icons.py --record")
+    source.add_argument("--synthetic", type=int, metavar="N",
+                        help="serve a generated library of N icons")
+    parser.add_argument("--file-key", default=FILE_KEY,
+                        help="file key for --synthetic (default: %(default)s)")
+    parser.add_argument("--team", metavar="TEAM_ID",
+                        help="also serve the library as this team's paginated listing")
+    parser.add_argument("--team-files", type=int, default=1, metavar="N",
+                        help="with --synthetic and --team, spread the icons over N files")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0, metavar="MS")
+    parser.add_argument("--jitter", type=float, default=0, metavar="MS")
+    parser.add_argument("--bandwidth", type=float, default=0, metavar="KB_PER_SEC",
+                        help="per-response send cap (0 = unlimited)")
+    parser.add_argument("--rate-429", type=float, default=0, metavar="P")
+    parser.add_argument("--rate-5xx", type=float, default=0, metavar="P")
+    parser.add_argument("--truncate", type=float, default=0, metavar="P",
+                        help="probability of closing the socket half-way through a body")
+    parser.add_argument("--retry-after", type=int, default=1, metavar="SECONDS",
+                        help="Retry-After on 429s (negative to omit)")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if args.fixtures:
+        routes = load_fixtures(args.fixtures)
+    else:
+        routes = {}
+        per_file = -(-args.synthetic // max(1, args.team_files))
+        for n in range(max(1, args.team_files)):
+            key = args.file_key if n == 0 else "{}{}".format(args.file_key[:-2], n + 10)
+            routes.update(synthetic_library(
+                per_file, seed=(args.seed or 0) + n, file_key=key,
+                thumb_base="http://{}:{}/_thumb/".format(args.host, args.port)))
+    config = StubConfig(
+        latency=args.latency / 1000.0,
+        jitter=args.jitter / 1000.0,
+        bandwidth=args.bandwidth * 1024,
+        rate_429=args.rate_429,
+        rate_5xx=args.rate_5xx,
+        truncate=args.truncate,
+        retry_after=args.retry_after if args.retry_after >= 0 else None,
+        verbose=args.verbose,
+        seed=args.seed,
+    )
+    server = FigmaStubServer((args.host, args.port), routes, config)
+    if args.team:
+        if args.fixtures:
+            routes = {ep: json.loads(body) for ep, body in routes.items()}
+        server.set_team(args.team, team_listing(routes))
+    print("Serving {} endpoints on http://{}:{}/v1".format(len(routes), args.host, args.port))
+    for endpoint in sorted(routes):
+        print("  /v1{}".format(endpoint))
+    if args.team:
+        print("  /v1/teams/{}/components, /component_sets (paginated)".format(args.team))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("\n" + ", ".join("{}={}".format(k, v) for k, v in server.stats.items()))
+
+
+if __name__ == "__main__":
+    main()
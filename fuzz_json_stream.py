@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Chunk-size fuzz check for extract_icons.iter_json_array
+
+Streams a synthetic /components listing from figma_stub_server (plus a
+document full of awkward numbers) through JsonStream at every chunk
+size in a range, so every value gets cut at every offset, and compares
+the result with json.loads.
+
+Usage:
+  python3 fuzz_json_stream.py                  # 300 icons, chunks of 1..64 bytes
+  python3 fuzz_json_stream.py -n 2000 --max-chunk 256
+"""
+
+import argparse
+import io
+import json
+import random
+
+import extract_icons
+import figma_stub_server
+
+
+def number_document(count, seed=0):
+    """{"meta": {"components": [...]}} whose items are mostly numbers split by '.', 'e', signs."""
+    rnd = random.Random(seed)
+    forms = ["{}", "-{}", "{}.{}", "-{}.{}", "{}e{}", "{}E-{}", "{}.{}e+{}", "-{}.{}E{}"]
+    items = []
+    for i in range(count):
+        form = rnd.choice(forms)
+        items.append(form.format(*(rnd.randint(0, 10 ** rnd.randint(0, 6))
+                                   for _ in range(form.count("{}")))))
+        if i % 5 == 0:
+            items[-1] = '{{"x": {}, "s": "é{}", "t": [true, null, {}]}}'.format(
+                items[-1], i, items[-1])
+    return '{"meta": {"components": [' + ", ".join(items) + "]}}"
+
+
+def check(name, data, max_chunk):
+    expected = json.loads(data)["meta"]["components"]
+    failures = 0
+    for size in range(1, max_chunk + 1):
+        try:
+            got = list(extract_icons.iter_json_array(
+                io.BytesIO(data), ("meta", "components"), size))
+        except ValueError as e:
+            got = e
+        if got != expected:
+            failures += 1
+            if failures <= 3:
+                print("  {}: chunk {} -> {}".format(
+                    name, size, got if isinstance(got, ValueError) else "wrong values"))
+    print("{:<12} {:>10,} bytes  chunk sizes 1-{}: {}".format(
+        name, len(data), max_chunk, "ok" if not failures else "{} FAILED".format(failures)))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", "--icons", type=int, default=300)
+    parser.add_argument("--max-chunk", type=int, default=64)
+    args = parser.parse_args()
+
+    routes = figma_stub_server.synthetic_library(args.icons)
+    listing = routes["/files/{}/components".format(figma_stub_server.FILE_KEY)]
+    documents = [
+        ("components", json.dumps(listing).encode("utf-8")),
+        ("numbers", number_document(args.icons).encode("utf-8")),
+    ]
+    failures = sum(check(name, data, args.max_chunk) for name, data in documents)
+    raise SystemExit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()